@@ -1,10 +1,20 @@
 import os
+import json
+import time
+import base64
 import dotenv
-import sqlite3
+import hashlib
 import logging
+import datetime
+import threading
+import functools
+from collections import OrderedDict
 import flask
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from markupsafe import Markup
+
+import database
+import ics_feed
+import metrics
 
 dotenv.load_dotenv()
 
@@ -22,22 +32,178 @@ SCOPES = [
     'https://www.googleapis.com/auth/calendar.events', 
     'https://www.googleapis.com/auth/userinfo.email'
 ]
+USERINFO_URL = 'https://www.googleapis.com/oauth2/v2/userinfo'
 
 DB_FILE = os.environ.get('DB_FILE')
 
+# Written by sync_worker after each run; served on /metrics
+SYNC_SUMMARY_FILE = os.environ.get('SYNC_SUMMARY_FILE', 'sync_summary.json')
+
+# Seconds a queued sync waits for further saves before job_worker.py runs it
+SYNC_JOB_DELAY = int(os.environ.get('SYNC_JOB_DELAY', '5'))
+
+# /api/events page sizes, and how many days it returns when no range is given
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_DEFAULT_DAYS = 7
+
+# Dashboard user rows cached per process; re-read after USER_CACHE_TTL seconds
+# since another web process may have saved newer settings
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 30
+
 # Configure Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Create/upgrade the schema (WAL mode, subscriptions table) on startup
+database.init_db(DB_FILE)
+
+def load_client_config(path):
+    """Reads the OAuth client JSON once at startup (None if it is missing)."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError) as e:
+        logger.warning(f"Could not read CLIENT_SECRETS_FILE '{path}': {e}. Login is disabled.")
+        return None
+
+CLIENT_CONFIG = load_client_config(CLIENT_SECRETS_FILE)
+
+def make_flow(state=None):
+    """
+    An OAuth Flow built from the parsed client config. google_auth_oauthlib
+    is imported here, on the first login, rather than when the app starts.
+    """
+    if CLIENT_CONFIG is None:
+        raise RuntimeError("OAuth client config is not available")
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_config(CLIENT_CONFIG, scopes=SCOPES, state=state)
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled connection; conn.close() returns it to the pool
+    return database.get_db_connection(DB_FILE)
+
+# --- HELPER: Cached Dashboard User Lookups ---
+class UserCache:
+    """A small thread-safe LRU of dashboard user rows keyed by email."""
+
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._rows = OrderedDict()  # email -> (loaded_at, row dict)
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        with self._lock:
+            entry = self._rows.get(email)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            self._rows.move_to_end(email)
+            return entry[1]
+
+    def put(self, email, row):
+        with self._lock:
+            self._rows[email] = (time.monotonic(), row)
+            self._rows.move_to_end(email)
+            while len(self._rows) > self.size:
+                self._rows.popitem(last=False)
+
+    def invalidate(self, email):
+        with self._lock:
+            self._rows.pop(email, None)
+
+USER_CACHE = UserCache()
+
+def load_dashboard_user(email, settings_version=None):
+    """
+    The few columns the dashboard needs, from USER_CACHE or one narrow query.
+    `settings_version` is the version this browser last saved (kept in its
+    session). The settings may have been saved through another web process,
+    whose cache invalidation never reached this one, so a cached row with a
+    different version is re-read.
+    """
+    user = USER_CACHE.get(email)
+    if user is not None and (settings_version is None or user['settings_version'] == settings_version):
+        return user
+
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT email, impact_pref, currencies_pref, delivery, feed_token, settings_version FROM users WHERE email = ?",
+        (email,)
+    ).fetchone()
+    if row is None:
+        conn.close()
+        return None
+
+    user = dict(row)
+    if not user['feed_token']:
+        user['feed_token'] = database.get_feed_token(conn, email)
+        conn.commit()
+    conn.close()
+
+    USER_CACHE.put(email, user)
+    return user
+
+# --- HELPER: Precompiled Dashboard Templates ---
+IMPACT_CHOICES = [('High', 'High Impact 🔴'), ('Medium', 'Medium Impact 🟠')]
+CURRENCY_CHOICES = [
+    ('USD', 'USD 🇺🇸'), ('EUR', 'EUR 🇪🇺'), ('GBP', 'GBP 🇬🇧'), ('JPY', 'JPY 🇯🇵'),
+    ('CAD', 'CAD 🇨🇦'), ('AUD', 'AUD 🇦🇺'), ('NZD', 'NZD 🇳🇿'), ('CHF', 'CHF 🇨🇭')
+]
+DELIVERY_CHOICES = [('api', 'Add events to my Google Calendar'), ('feed', 'I subscribe to the calendar feed instead')]
+
+# The settings form depends only on the preference signature, so it is
+# rendered once per signature; the page around it is per user.
+SETTINGS_FORM = app.jinja_env.from_string('''
+            <form action="/save_settings" method="post">
+                <h4>1. Impact Level</h4>
+                {%- for value, label in impact_choices %}
+                <label><input type="checkbox" name="impact" value="{{ value }}" {{ 'checked' if value in impacts }}> {{ label }}</label>{% if not loop.last %}<br>{% endif %}
+                {%- endfor %}
+
+                <h4>2. Currencies</h4>
+                <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">
+                {%- for value, label in currency_choices %}
+                    <label><input type="checkbox" name="currency" value="{{ value }}" {{ 'checked' if value in currencies }}> {{ label }}</label>
+                {%- endfor %}
+                </div>
+
+                <h4>3. Delivery</h4>
+                {%- for value, label in delivery_choices %}
+                <label><input type="radio" name="delivery" value="{{ value }}" {{ 'checked' if value == delivery }}> {{ label }}</label>{% if not loop.last %}<br>{% endif %}
+                {%- endfor %}
+
+                <br><br>
+                <button type="submit" style="background-color: #0F9D58; color: white; padding: 12px 24px; border: none; border-radius: 4px; font-size: 16px; cursor: pointer; width: 100%;">
+                    Save Changes
+                </button>
+            </form>
+''')
+
+DASHBOARD_PAGE = app.jinja_env.from_string('''
+        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px;">
+            <div style="display:flex; justify-content:space-between; align-items:center;">
+                <h3>⚙️ Settings for {{ email }}</h3>
+                <a href="/logout" style="color:red; text-decoration:none;">Logout</a>
+            </div>
+            <hr>
+            {{ form }}
+            <p style="font-size: 13px; color: #555;">Feed URL (add it in your calendar app via "From URL"):<br>
+                <input type="text" readonly value="{{ feed_url }}" style="width: 100%;" onclick="this.select()">
+            </p>
+        </div>
+''')
 
-# --- HELPER: Decides if a box should be checked ---
-def is_checked(value, csv_string):
-    if not csv_string: return ""
-    return "checked" if value in csv_string.split(',') else ""
+@functools.lru_cache(maxsize=256)
+def render_settings_form(signature, delivery):
+    """Returns (html, etag) of the settings form for one preference signature."""
+    impacts, currencies = signature
+    html = Markup(SETTINGS_FORM.render(
+        impact_choices=IMPACT_CHOICES, currency_choices=CURRENCY_CHOICES, delivery_choices=DELIVERY_CHOICES,
+        impacts=impacts, currencies=currencies, delivery=delivery
+    ))
+    return html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:16]
 
 # --- ROUTE 1: The Login Gate ---
 @app.route('/')
@@ -61,7 +227,7 @@ def index():
 # --- ROUTE 2: Google Auth Flow ---
 @app.route('/login')
 def login():
-    flow = Flow.from_client_secrets_file(CLIENT_SECRETS_FILE, scopes=SCOPES)
+    flow = make_flow()
     flow.redirect_uri = flask.url_for('callback', _external=True)
     
     # We use prompt='consent' to ensure we get a Refresh Token if we don't have one
@@ -78,16 +244,16 @@ def login():
 def callback():
     try:
         state = flask.session['state']
-        flow = Flow.from_client_secrets_file(CLIENT_SECRETS_FILE, scopes=SCOPES, state=state)
+        flow = make_flow(state=state)
         flow.redirect_uri = flask.url_for('callback', _external=True)
         
         flow.fetch_token(authorization_response=flask.request.url)
         creds = flow.credentials
 
-        # Get User Email
-        user_info_service = build('oauth2', 'v2', credentials=creds)
-        user_info = user_info_service.userinfo().get().execute()
-        email = user_info['email']
+        # Get User Email (one plain GET; no API client needed)
+        response = flow.authorized_session().get(USERINFO_URL, timeout=30)
+        response.raise_for_status()
+        email = response.json()['email']
 
         # Database Logic
         conn = get_db_connection()
@@ -99,18 +265,24 @@ def callback():
             # User exists: Update token ONLY if Google gave us a new one
             new_token = creds.refresh_token if creds.refresh_token else user['refresh_token']
             conn.execute("UPDATE users SET refresh_token = ? WHERE email = ?", (new_token, email))
+            settings_version = user['settings_version']
         else:
             # New User: Insert with defaults
             conn.execute('''
-                INSERT INTO users (email, refresh_token, impact_pref, currencies_pref, last_updated)
-                VALUES (?, ?, 'High', 'USD,EUR,GBP', CURRENT_TIMESTAMP)
+                INSERT INTO users (email, refresh_token, last_updated)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
             ''', (email, creds.refresh_token))
+            settings_version = database.set_preferences(conn, email, ['High'], ['USD', 'EUR', 'GBP'])
+            # Fill the new calendar now rather than at the next full run
+            database.enqueue_job(conn, 'sync_user', email)
         
         conn.commit()
         conn.close()
+        USER_CACHE.invalidate(email)
 
         # Log the user in (Save to Session)
         flask.session['user_email'] = email
+        flask.session['settings_version'] = settings_version
         return flask.redirect('/dashboard')
 
     except Exception as e:
@@ -126,50 +298,25 @@ def dashboard():
     
     email = flask.session['user_email']
     
-    # Fetch current settings from DB
-    conn = get_db_connection()
-    user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-    conn.close()
+    # Fetch current settings (cached; only the columns the page shows)
+    user = load_dashboard_user(email, flask.session.get('settings_version'))
 
     if not user:
         return "Error: User not found in database."
 
-    # Parse settings for the UI
-    impacts = user['impact_pref'] or ""
-    currencies = user['currencies_pref'] or ""
-
-    return f'''
-        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px;">
-            <div style="display:flex; justify-content:space-between; align-items:center;">
-                <h3>⚙️ Settings for {email}</h3>
-                <a href="/logout" style="color:red; text-decoration:none;">Logout</a>
-            </div>
-            <hr>
-            
-            <form action="/save_settings" method="post">
-                <h4>1. Impact Level</h4>
-                <label><input type="checkbox" name="impact" value="High" {is_checked('High', impacts)}> High Impact 🔴</label><br>
-                <label><input type="checkbox" name="impact" value="Medium" {is_checked('Medium', impacts)}> Medium Impact 🟠</label>
+    # The form is rendered once per preference signature and shared by every user with it
+    form, form_etag = render_settings_form(database.preference_signature(user), user['delivery'] or 'api')
+    feed_url = flask.url_for('feed', token=user['feed_token'], _external=True)
+    etag = hashlib.sha256(f"{form_etag}|{email}|{feed_url}".encode('utf-8')).hexdigest()[:32]
 
-                <h4>2. Currencies</h4>
-                <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">
-                    <label><input type="checkbox" name="currency" value="USD" {is_checked('USD', currencies)}> USD 🇺🇸</label>
-                    <label><input type="checkbox" name="currency" value="EUR" {is_checked('EUR', currencies)}> EUR 🇪🇺</label>
-                    <label><input type="checkbox" name="currency" value="GBP" {is_checked('GBP', currencies)}> GBP 🇬🇧</label>
-                    <label><input type="checkbox" name="currency" value="JPY" {is_checked('JPY', currencies)}> JPY 🇯🇵</label>
-                    <label><input type="checkbox" name="currency" value="CAD" {is_checked('CAD', currencies)}> CAD 🇨🇦</label>
-                    <label><input type="checkbox" name="currency" value="AUD" {is_checked('AUD', currencies)}> AUD 🇦🇺</label>
-                    <label><input type="checkbox" name="currency" value="NZD" {is_checked('NZD', currencies)}> NZD 🇳🇿</label>
-                    <label><input type="checkbox" name="currency" value="CHF" {is_checked('CHF', currencies)}> CHF 🇨🇭</label>
-                </div>
-                
-                <br>
-                <button type="submit" style="background-color: #0F9D58; color: white; padding: 12px 24px; border: none; border-radius: 4px; font-size: 16px; cursor: pointer; width: 100%;">
-                    Save Changes
-                </button>
-            </form>
-        </div>
-    '''
+    # Unchanged page: answer 304 without rendering anything
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(DASHBOARD_PAGE.render(email=email, form=form, feed_url=feed_url))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 # --- ROUTE 4: Save Actions ---
 @app.route('/save_settings', methods=['POST'])
@@ -182,20 +329,131 @@ def save_settings():
     # Get lists from form
     impact_list = flask.request.form.getlist('impact')
     currency_list = flask.request.form.getlist('currency')
-    
-    # Join into strings
-    impact_str = ",".join(impact_list)
-    currency_str = ",".join(currency_list)
+    delivery = flask.request.form.get('delivery', 'api')
+    if delivery not in ('api', 'feed'):
+        delivery = 'api'
 
-    # Update DB
+    # Update DB (CSV columns + normalised subscriptions)
     conn = get_db_connection()
-    conn.execute("UPDATE users SET impact_pref = ?, currencies_pref = ? WHERE email = ?", 
-                 (impact_str, currency_str, email))
+    settings_version = database.set_preferences(conn, email, impact_list, currency_list)
+    conn.execute("UPDATE users SET delivery = ? WHERE email = ?", (delivery, email))
+    # Sync just this user in the background; repeated saves share one job
+    database.enqueue_job(conn, 'sync_user', email, delay=SYNC_JOB_DELAY)
     conn.commit()
     conn.close()
+    USER_CACHE.invalidate(email)
+    # Lets whichever web process serves the redirect spot a stale cached row
+    flask.session['settings_version'] = settings_version
 
     return flask.redirect('/dashboard')
 
+# --- ROUTE 5: ICS Subscription Feed ---
+@app.route('/feed/<token>.ics')
+def feed(token):
+    # The token is the only credential: calendar apps can't log in
+    conn = get_db_connection()
+    user = conn.execute(
+        "SELECT impact_pref, currencies_pref FROM users WHERE feed_token = ?", (token,)
+    ).fetchone()
+    conn.close()
+
+    if not user:
+        flask.abort(404)
+
+    # Rendered once per preference signature; unchanged feeds get a 304
+    body, etag = ics_feed.get_user_feed(user)
+    response = flask.Response(body, mimetype='text/calendar')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response.make_conditional(flask.request)
+
+# --- ROUTE 6: Historical Events API ---
+def _list_arg(name):
+    # Accepts both ?currency=USD,EUR and ?currency=USD&currency=EUR
+    return [v.strip() for raw in flask.request.args.getlist(name) for v in raw.split(',') if v.strip()]
+
+def _encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row['day']}|{row['currency']}|{row['event_id']}".encode()).decode()
+
+def _decode_cursor(cursor):
+    parts = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    if len(parts) != 3:
+        raise ValueError("invalid cursor")
+    return parts
+
+@app.route('/api/events')
+def api_events():
+    """
+    Archived events from the 'events' table; never triggers a scrape.
+    Query: from, to (YYYY-MM-DD), currency, impact, limit, cursor.
+    """
+    args = flask.request.args
+    today = datetime.date.today()
+    try:
+        last_day = datetime.date.fromisoformat(args['to']) if args.get('to') else today
+        first_day = (datetime.date.fromisoformat(args['from']) if args.get('from')
+                     else last_day - datetime.timedelta(days=API_DEFAULT_DAYS - 1))
+        limit = max(1, min(int(args.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE))
+        after = _decode_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError as e:
+        return flask.jsonify(error=f"Bad request: {e}"), 400
+
+    currencies = [c.upper() for c in _list_arg('currency')]
+    impacts = [i.capitalize() for i in _list_arg('impact')]
+
+    # Every filter is on (day, currency, impact), which the indexes cover
+    where = ["day BETWEEN ? AND ?"]
+    params = [first_day.isoformat(), last_day.isoformat()]
+    if currencies:
+        where.append(f"currency IN ({','.join('?' * len(currencies))})")
+        params += currencies
+    if impacts:
+        where.append(f"impact IN ({','.join('?' * len(impacts))})")
+        params += impacts
+    if after:
+        where.append("(day, currency, event_id) > (?, ?, ?)")
+        params += after
+
+    conn = get_db_connection()
+    rows = conn.execute(f'''
+        SELECT day, currency, event_id, title, impact, time, forecast, actual, updated_at FROM events
+        WHERE {' AND '.join(where)}
+        ORDER BY day, currency, event_id
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+    conn.close()
+
+    page = [dict(row) for row in rows[:limit]]
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    payload = {
+        'from': first_day.isoformat(),
+        'to': last_day.isoformat(),
+        'count': len(page),
+        'events': page,
+        'next_cursor': next_cursor,
+        # Keep repeated parameters (?currency=USD&currency=EUR) in the next link
+        'next': flask.url_for('api_events', **dict(args.to_dict(flat=False), cursor=[next_cursor])) if next_cursor else None
+    }
+
+    response = flask.jsonify(payload)
+    # Past days are settled; ranges that include today change as 'actual' values come in
+    response.headers['Cache-Control'] = 'public, max-age=86400' if last_day < today else 'public, max-age=60'
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest()[:32])
+    return response.make_conditional(flask.request)
+
+# --- ROUTE 7: Prometheus Metrics ---
+@app.after_request
+def count_request(response):
+    metrics.REGISTRY.inc('forex_app_requests_total', help_text="HTTP requests served by the web app.",
+                         endpoint=flask.request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Web app counters + the metrics saved by the last sync_worker run
+    body = metrics.REGISTRY.render() + metrics.render_summary_file(SYNC_SUMMARY_FILE)
+    return flask.Response(body, mimetype='text/plain; version=0.0.4')
+
 @app.route('/logout')
 def logout():
     flask.session.clear()
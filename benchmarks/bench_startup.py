@@ -0,0 +1,121 @@
+"""
+Cold-start benchmark: how long a fresh process takes to import each entry
+point, which heavy libraries that import drags in, and the latency of the
+first requests a new web process serves.
+
+Every sample runs in a new interpreter (nothing is warm), against a
+throwaway DB and a dummy OAuth client config, so no network is used.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --json startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['sync_worker', 'job_worker', 'scheduler', 'app']
+
+# Libraries that should only load when they are actually needed
+HEAVY_MODULES = [
+    'selenium', 'webdriver_manager', 'googleapiclient.discovery', 'google_auth_oauthlib',
+    'google.oauth2.credentials', 'httplib2', 'lxml.html', 'requests', 'cryptography.fernet'
+]
+
+IMPORT_SCRIPT = """
+import sys, json, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+REQUEST_SCRIPT = """
+import sys, json, time
+sys.path.insert(0, {root!r})
+timings = {{}}
+started = time.perf_counter()
+import app
+timings['import'] = time.perf_counter() - started
+client = app.app.test_client()
+for path in {paths!r}:
+    started = time.perf_counter()
+    status = client.get(path).status_code
+    timings[path] = time.perf_counter() - started
+    timings[path + ' status'] = status
+print(json.dumps(timings))
+"""
+
+FIRST_REQUESTS = ['/', '/login', '/api/events', '/metrics']
+
+def make_env(work_dir):
+    client_config = os.path.join(work_dir, 'client_secret.json')
+    with open(client_config, 'w') as f:
+        json.dump({'web': {
+            'client_id': 'bench-client.apps.googleusercontent.com',
+            'client_secret': 'bench-secret',
+            'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+            'redirect_uris': ['http://localhost:5000/callback']
+        }}, f)
+
+    env = dict(os.environ)
+    env.update({
+        'DB_FILE': os.path.join(work_dir, 'startup.db'),
+        'CLIENT_SECRETS_FILE': client_config,
+        'FLASK_SECRET_KEY': 'bench',
+        'SYNC_SUMMARY_FILE': os.path.join(work_dir, 'sync_summary.json')
+    })
+    return env
+
+def run_child(script, env, cwd):
+    output = subprocess.run(
+        [sys.executable, '-c', script], env=env, cwd=cwd, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument('--json', help="Write the report to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    env = make_env(work_dir)
+
+    # Create the schema once so every sample measures the same thing
+    run_child(IMPORT_SCRIPT.format(root=ROOT, module='database', heavy=HEAVY_MODULES) +
+              "database.init_db()\n", env, work_dir)
+
+    report = {'runs': args.runs, 'imports': {}, 'first_requests': {}}
+
+    # --- 1. Import Time per Entry Point ---
+    for module in MODULES:
+        samples = [run_child(IMPORT_SCRIPT.format(root=ROOT, module=module, heavy=HEAVY_MODULES), env, work_dir)
+                   for _ in range(args.runs)]
+        median = statistics.median(s['seconds'] for s in samples)
+        report['imports'][module] = {'median_ms': round(median * 1000, 1), 'heavy_loaded': samples[0]['loaded']}
+        loaded = ', '.join(samples[0]['loaded']) or 'none'
+        print(f"import {module:<12} {median * 1000:8.1f} ms   heavy modules: {loaded}")
+
+    # --- 2. First Requests of a New Web Process ---
+    samples = [run_child(REQUEST_SCRIPT.format(root=ROOT, paths=FIRST_REQUESTS), env, work_dir) for _ in range(args.runs)]
+    for key in ['import'] + FIRST_REQUESTS:
+        median = statistics.median(s[key] for s in samples)
+        status = f"(HTTP {samples[0][key + ' status']})" if key != 'import' else ''
+        report['first_requests'][key] = round(median * 1000, 1)
+        print(f"first {key:<16} {median * 1000:8.1f} ms {status}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
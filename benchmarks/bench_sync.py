@@ -0,0 +1,146 @@
+"""
+Offline throughput benchmark for sync_worker.sync_calendars().
+
+Starts benchmarks/fake_google.py in-process, generates a synthetic users DB,
+seeds today's event snapshot from a saved ForexFactory page (so nothing is
+scraped), then runs the worker several times and reports:
+  - runs/sec and users/sec
+  - API calls and HTTP requests per user
+  - p50/p99 per-user sync latency
+
+Usage:
+    python benchmarks/bench_sync.py --users 5000 --workers 16 --latency-ms 40
+    python benchmarks/bench_sync.py --cold          # clear the ledger before every run
+    python benchmarks/bench_sync.py --json out.json # also write the report as JSON
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_google import start_in_background
+from make_users_db import make_users_db
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--db', help="Use an existing users DB instead of generating one")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fixture', default=os.path.join(ROOT, 'fixtures', 'calendar_today.html'))
+    parser.add_argument('--cold', action='store_true', help="Clear event_ledger before every run")
+    parser.add_argument('--json', help="Write the report to this file")
+    args = parser.parse_args()
+
+    # --- 1. Fake Google + Synthetic Users ---
+    server, state, base_url = start_in_background(latency_ms=args.latency_ms, error_rate=args.error_rate, seed=1)
+    work_dir = tempfile.mkdtemp()
+    db_file = args.db or make_users_db(os.path.join(work_dir, 'bench_users.db'), args.users)
+
+    # The worker reads its configuration at import time
+    os.environ.update({
+        'DB_FILE': db_file,
+        'GOOGLE_TOKEN_URI': base_url + 'token',
+        'GOOGLE_API_ROOT_URL': base_url,
+        'CLIENT_ID': 'bench-client',
+        'CLIENT_SECRET': 'bench-secret',
+        'SNAPSHOT_TTL_TODAY': str(10 ** 9),
+        'PREFETCH_WEEK': '0',
+        'SYNC_WORKERS': str(args.workers),
+        'SYNC_SUMMARY_FILE': os.path.join(work_dir, 'sync_summary.json')
+    })
+    # Measure the worker, not the production quota (export these to override)
+    os.environ.setdefault('CALENDAR_GLOBAL_QPS', '100000')
+    os.environ.setdefault('CALENDAR_USER_QPS', '100000')
+
+    import database
+    import event_cache
+    import sync_worker
+    from get_data import parse_calendar_html
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # --- 2. Replayable Scrape Fixture ---
+    today = datetime.date.today()
+    with open(args.fixture, encoding='utf-8') as f:
+        events = parse_calendar_html(f.read(), today)
+    for event in events:
+        event['date'] = today.isoformat()
+    event_cache.save_snapshots({today: events})
+
+    conn = database.get_db_connection(db_file)
+    user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+
+    # --- 3. Runs ---
+    report = {
+        'users': user_count,
+        'workers': args.workers,
+        'latency_ms': args.latency_ms,
+        'error_rate': args.error_rate,
+        'events': len(events),
+        'runs': []
+    }
+    print(f"Benchmark: {user_count} users, {len(events)} events, {args.workers} workers, "
+          f"{args.latency_ms}ms latency, {args.error_rate:.1%} 429s")
+
+    for run in range(1, args.runs + 1):
+        if args.cold:
+            conn = database.get_db_connection(db_file)
+            conn.execute("DELETE FROM event_ledger")
+            conn.commit()
+            conn.close()
+
+        state.reset_counters()
+        started = time.perf_counter()
+        results = sync_worker.sync_calendars(max_workers=args.workers)
+        elapsed = time.perf_counter() - started
+
+        counters = state.snapshot()
+        latencies = sorted(r['seconds'] for r in results)
+        summary = {
+            'run': run,
+            'seconds': round(elapsed, 3),
+            'runs_per_sec': round(1 / elapsed, 3) if elapsed else None,
+            'users_per_sec': round(len(results) / elapsed, 1) if elapsed else None,
+            'api_calls_per_user': round(counters['api_calls'] / max(user_count, 1), 2),
+            'http_requests_per_user': round(counters['http_requests'] / max(user_count, 1), 2),
+            'p50_user_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p99_user_ms': round(percentile(latencies, 99) * 1000, 1),
+            'errors': sum(1 for r in results if r['status'] == 'error'),
+            'failed_events': sum(r['failed'] for r in results),
+            'server': counters
+        }
+        report['runs'].append(summary)
+        print(f"run {run}: {summary['seconds']}s | {summary['users_per_sec']} users/s | "
+              f"{summary['api_calls_per_user']} API calls/user | "
+              f"{summary['http_requests_per_user']} HTTP req/user | "
+              f"p50 {summary['p50_user_ms']}ms p99 {summary['p99_user_ms']}ms | "
+              f"{summary['errors']} user errors, {summary['failed_events']} failed events")
+
+    server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
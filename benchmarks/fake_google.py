@@ -0,0 +1,273 @@
+"""
+Local stand-in for the Google OAuth token endpoint and the Calendar v3
+events API, so the sync worker can be benchmarked without real accounts.
+
+Point the worker at it with:
+    GOOGLE_TOKEN_URI=http://127.0.0.1:<port>/token
+    GOOGLE_API_ROOT_URL=http://127.0.0.1:<port>/
+
+Supports token refresh, events insert/update/delete/list (including
+incremental sync tokens and deleted tombstones) and Calendar batch requests. Latency and a random 429 rate are configurable. Run it on its own
+with: python benchmarks/fake_google.py --port 8765 --latency-ms 40
+"""
+import re
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+from email.parser import Parser
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EVENTS_PATH = re.compile(r"^/calendar/v3/calendars/([^/]+)/events(?:/([^/?]+))?$")
+
+class FakeGoogleState:
+    """Per-server state: events per access token plus request counters."""
+
+    def __init__(self, latency_ms=0, error_rate=0.0, seed=None):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calendars = {}  # access_token -> {event_id: event}; deleted events stay as tombstones
+        self.seq = 0  # Bumped on every write; sync tokens are 'sync-<seq>'
+        self.counters = {
+            'http_requests': 0,
+            'token_refreshes': 0,
+            'batch_requests': 0,
+            'api_calls': 0,
+            'inserts': 0,
+            'updates': 0,
+            'deletes': 0,
+            'lists': 0,
+            'conflicts': 0,
+            'rate_limited': 0
+        }
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def reset_counters(self):
+        with self.lock:
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def _stamp(self, event):
+        # Caller holds the lock
+        self.seq += 1
+        event['_seq'] = self.seq
+        event['updated'] = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        return event
+
+    def _public(self, event):
+        return {k: v for k, v in event.items() if k != '_seq'}
+
+    def _list(self, events, query):
+        """events.list: everything, or only what changed since ?syncToken=."""
+        sync_token = query.get('syncToken', [None])[0]
+        if sync_token:
+            if not re.fullmatch(r'sync-\d+', sync_token):
+                return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid, a full sync is required.',
+                                       'errors': [{'reason': 'fullSyncRequired'}]}}
+            since = int(sync_token.split('-')[1])
+            items = [e for e in events.values() if e['_seq'] > since]
+        else:
+            show_deleted = query.get('showDeleted', ['false'])[0] == 'true'
+            items = [e for e in events.values() if show_deleted or e.get('status') != 'cancelled']
+        items = [self._public(e) for e in items]
+        return 200, {'items': items, 'nextSyncToken': f"sync-{self.seq}"}
+
+    def rate_limited(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    # --- Calendar API ---
+    def handle_api(self, method, path, token, body):
+        """Returns (status, json_dict) for one events API call."""
+        self.count('api_calls')
+        if self.rate_limited():
+            self.count('rate_limited')
+            return 429, {'error': {'code': 429, 'message': 'Rate Limit Exceeded',
+                                   'errors': [{'reason': 'rateLimitExceeded'}]}}
+
+        url = urlparse(path)
+        match = EVENTS_PATH.match(url.path)
+        if not match:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+
+        event_id = unquote(match.group(2)) if match.group(2) else None
+        with self.lock:
+            events = self.calendars.setdefault(token, {})
+
+            if method == 'POST' and event_id is None:
+                event_id = body.get('id')
+                if event_id in events:
+                    self.counters['conflicts'] += 1
+                    return 409, {'error': {'code': 409, 'message': 'The requested identifier already exists.',
+                                           'errors': [{'reason': 'duplicate'}]}}
+                events[event_id] = self._stamp(dict(body, status='confirmed'))
+                self.counters['inserts'] += 1
+                return 200, self._public(events[event_id])
+
+            if method in ('PUT', 'PATCH') and event_id:
+                if event_id not in events:
+                    return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+                events[event_id] = self._stamp(
+                    dict(events[event_id], **body) if method == 'PATCH' else dict(body, id=event_id, status='confirmed')
+                )
+                self.counters['updates'] += 1
+                return 200, self._public(events[event_id])
+
+            if method == 'DELETE' and event_id:
+                if event_id not in events:
+                    return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+                if events[event_id].get('status') == 'cancelled':
+                    return 410, {'error': {'code': 410, 'message': 'Resource has been deleted'}}
+                # Like the real API, a tombstone keeps nothing but its id and status
+                events[event_id] = self._stamp({'id': event_id, 'status': 'cancelled'})
+                self.counters['deletes'] += 1
+                return 204, None
+
+            if method == 'GET' and event_id is None:
+                self.counters['lists'] += 1
+                return self._list(events, parse_qs(url.query))
+
+            if method == 'GET' and event_id in events:
+                return 200, self._public(events[event_id])
+
+        return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # set by make_server()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, payload, content_type='application/json'):
+        data = b'' if payload is None else (
+            payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        )
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _token(self, headers):
+        return (headers.get('Authorization') or headers.get('authorization') or '').replace('Bearer ', '')
+
+    def _dispatch(self, method):
+        state = self.state
+        state.count('http_requests')
+        if state.latency:
+            time.sleep(state.latency)
+
+        raw = self._read_body()
+        path = urlparse(self.path).path
+
+        if path == '/token':
+            form = parse_qs(raw.decode())
+            state.count('token_refreshes')
+            refresh_token = form.get('refresh_token', [''])[0]
+            return self._send(200, {
+                'access_token': f"at-{refresh_token}",
+                'expires_in': 3600,
+                'token_type': 'Bearer',
+                'scope': 'https://www.googleapis.com/auth/calendar.events'
+            })
+
+        if path.startswith('/batch/'):
+            return self._handle_batch(raw)
+
+        body = json.loads(raw) if raw else {}
+        status, payload = state.handle_api(method, self.path, self._token(self.headers), body)
+        self._send(status, payload)
+
+    def _handle_batch(self, raw):
+        """Answers a multipart/mixed Calendar batch request part by part."""
+        self.state.count('batch_requests')
+        outer_token = self._token(self.headers)
+        message = Parser().parsestr(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n" + raw.decode('utf-8')
+        )
+
+        boundary = f"batch_{random.getrandbits(64):x}"
+        parts = []
+        for part in message.get_payload():
+            request_text = part.get_payload()
+            request_line, rest = request_text.split('\n', 1)
+            method, target, _ = request_line.strip().split(' ', 2)
+            inner = Parser().parsestr(rest)
+            inner_body = inner.get_payload()
+            body = json.loads(inner_body) if inner_body.strip() else {}
+
+            status, payload = self.state.handle_api(method, target, self._token(inner) or outer_token, body)
+            content = '' if payload is None else json.dumps(payload)
+            # Long Content-IDs get folded by the client; unfold per RFC 5322
+            content_id = re.sub(r'\r?\n', '', part['Content-ID']).strip()[1:-1]
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(content)}\r\n\r\n"
+                f"{content}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        self._send(200, ''.join(parts).encode(), f"multipart/mixed; boundary={boundary}")
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+def make_server(port=0, latency_ms=0, error_rate=0.0, seed=None):
+    """Returns (server, state). Port 0 picks a free port (see server.server_port)."""
+    state = FakeGoogleState(latency_ms, error_rate, seed)
+    handler = type('BoundFakeGoogleHandler', (FakeGoogleHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server, state
+
+def start_in_background(**kwargs):
+    """Starts the fake server on a daemon thread. Returns (server, state, base_url)."""
+    server, state = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_port}/"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of API calls answered with 429")
+    args = parser.parse_args()
+
+    server, _ = make_server(args.port, args.latency_ms, args.error_rate)
+    print(f"Fake Google listening on http://127.0.0.1:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,69 @@
+"""
+Generates a synthetic users.db for benchmarking the sync worker.
+
+Preferences are drawn from a handful of popular combinations plus a tail
+of random ones, which is roughly what real sign-ups look like.
+Usage: python benchmarks/make_users_db.py --users 10000 --out bench_users.db
+"""
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+IMPACTS = ['High', 'Medium']
+CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'CAD', 'AUD', 'NZD', 'CHF']
+
+# (weight, impacts, currencies)
+COMMON_PREFERENCES = [
+    (40, ['High'], ['USD', 'EUR', 'GBP']),   # The sign-up default
+    (15, ['High', 'Medium'], ['USD']),
+    (10, ['High'], ['USD']),
+    (10, ['High', 'Medium'], ['USD', 'EUR', 'GBP', 'JPY']),
+]
+RANDOM_WEIGHT = 25
+
+def random_preferences(rng):
+    weights = [w for w, _, _ in COMMON_PREFERENCES] + [RANDOM_WEIGHT]
+    choice = rng.choices(range(len(weights)), weights=weights)[0]
+    if choice < len(COMMON_PREFERENCES):
+        _, impacts, currencies = COMMON_PREFERENCES[choice]
+        return impacts, currencies
+
+    impacts = rng.sample(IMPACTS, rng.randint(1, len(IMPACTS)))
+    currencies = rng.sample(CURRENCIES, rng.randint(1, len(CURRENCIES)))
+    return sorted(impacts), sorted(currencies)
+
+def make_users_db(path, users, seed=42):
+    """Creates (or replaces) `path` with `users` synthetic users."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    database.init_db(path)
+    rng = random.Random(seed)
+
+    conn = database.get_db_connection(path)
+    conn.executemany(
+        "INSERT INTO users (email, refresh_token) VALUES (?, ?)",
+        [(f"user{i}@example.com", f"rt-{i}") for i in range(users)]
+    )
+    for i in range(users):
+        impacts, currencies = random_preferences(rng)
+        database.set_preferences(conn, f"user{i}@example.com", impacts, currencies)
+    conn.commit()
+    conn.close()
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--out', default='bench_users.db')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    make_users_db(args.out, args.users, args.seed)
+    print(f"Wrote {args.users} users to {args.out}")
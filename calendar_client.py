@@ -0,0 +1,152 @@
+import os
+import json
+import datetime
+import logging
+import threading
+import dotenv
+
+# The Google client libraries and cryptography are imported where they are
+# used: a worker run where nobody needs a write never pays for loading them.
+
+dotenv.load_dotenv()
+
+# --- CONFIGURATION ---
+TOKEN_URI = os.environ.get('GOOGLE_TOKEN_URI', "https://oauth2.googleapis.com/token")
+# Overrides the Calendar API root, e.g. to point at benchmarks/fake_google.py
+API_ROOT_URL = os.environ.get('GOOGLE_API_ROOT_URL')
+CALENDAR_SCOPES = ['https://www.googleapis.com/auth/calendar.events']
+
+# Fernet key (generate with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())")
+TOKEN_ENCRYPTION_KEY = os.environ.get('TOKEN_ENCRYPTION_KEY')
+HTTP_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_discovery_doc = None
+_fernet = None
+_cache_warned = False
+
+# --- TOKEN ENCRYPTION ---
+def _get_fernet():
+    """
+    The Fernet used for cached access tokens, or None when no
+    TOKEN_ENCRYPTION_KEY is set (the cache is then off, which is logged once).
+    A key without the cryptography package is a configuration error.
+    """
+    global _fernet, _cache_warned
+    with _lock:
+        if _fernet is None and TOKEN_ENCRYPTION_KEY:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                raise RuntimeError(
+                    "TOKEN_ENCRYPTION_KEY is set but the 'cryptography' package is not installed"
+                ) from None
+            _fernet = Fernet(TOKEN_ENCRYPTION_KEY.encode())
+        elif _fernet is None and not _cache_warned:
+            _cache_warned = True
+            logger.warning(
+                "Access-token cache disabled: TOKEN_ENCRYPTION_KEY is not set, "
+                "so every run refreshes every user's OAuth token."
+            )
+        return _fernet
+
+def token_cache_enabled():
+    return _get_fernet() is not None
+
+def encrypt_token(token):
+    fernet = _get_fernet()
+    if fernet is None or not token:
+        return None
+    return fernet.encrypt(token.encode()).decode()
+
+def decrypt_token(encrypted):
+    """Returns the plain access token, or None if it can't be decrypted (e.g. rotated key)."""
+    fernet = _get_fernet()
+    if fernet is None or not encrypted:
+        return None
+    from cryptography.fernet import InvalidToken
+    try:
+        return fernet.decrypt(encrypted.encode()).decode()
+    except InvalidToken:
+        return None
+
+# --- CREDENTIALS ---
+def _thread_session():
+    """One requests.Session per worker thread, so token refreshes reuse connections."""
+    if not hasattr(_local, 'session'):
+        import requests
+        _local.session = requests.Session()
+    return _local.session
+
+def _thread_http():
+    """One httplib2.Http per worker thread (httplib2 is not thread-safe)."""
+    if not hasattr(_local, 'http'):
+        import httplib2
+        _local.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return _local.http
+
+def get_credentials(user, client_id, client_secret, token_uri=TOKEN_URI):
+    """
+    Builds Credentials for a users row, reusing the cached access token
+    while it is still valid. google-auth treats a token as expired a few
+    minutes early, so we only refresh when it is close to expiry.
+    Returns (creds, refreshed).
+    """
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+
+    token = None
+    expiry = None
+    if 'access_token' in user.keys() and user['access_token'] and user['token_expiry']:
+        token = decrypt_token(user['access_token'])
+        expiry = datetime.datetime.fromisoformat(user['token_expiry']) if token else None
+
+    creds = Credentials(
+        token=token,
+        refresh_token=user['refresh_token'],
+        token_uri=token_uri,
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=CALENDAR_SCOPES,
+        expiry=expiry
+    )
+
+    if creds.valid:
+        return creds, False
+
+    creds.refresh(Request(session=_thread_session()))
+    return creds, True
+
+def token_columns(creds):
+    """Values for the users.access_token / users.token_expiry columns."""
+    if not token_cache_enabled() or not creds.token or not creds.expiry:
+        return None, None
+    return encrypt_token(creds.token), creds.expiry.isoformat()
+
+# --- CALENDAR SERVICE ---
+def _get_discovery_doc():
+    """The Calendar v3 discovery document, loaded and parsed once per process."""
+    global _discovery_doc
+    with _lock:
+        if _discovery_doc is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            _discovery_doc = json.loads(get_static_doc('calendar', 'v3'))
+            if API_ROOT_URL:
+                # Batch requests use rootUrl too, so this redirects everything
+                _discovery_doc['rootUrl'] = API_ROOT_URL
+        return _discovery_doc
+
+def calendar_service(creds):
+    """
+    Returns a Calendar v3 service for `creds`. The discovery document is
+    shared by every call and the HTTP connection is reused by every user
+    synced on the same thread.
+    """
+    import google_auth_httplib2
+    from googleapiclient.discovery import build_from_document
+
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=_thread_http())
+    return build_from_document(_get_discovery_doc(), http=http)
@@ -1,6 +1,10 @@
 import sqlite3
 import logging
 import os
+import queue
+import secrets
+import threading
+import time
 
 # Configure logging to display timestamp, log level, and message
 logging.basicConfig(
@@ -11,22 +15,121 @@ logger = logging.getLogger(__name__)
 
 DB_FILE = 'users.db'
 
-def init_db():
+# Bump when a migration is added to migrate_db()
+SCHEMA_VERSION = 1
+
+# Idle connections kept per database file by ConnectionPool
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+
+def add_column_if_missing(cursor, table, column, declaration):
+    """
+    Adds a column to an existing table. SQLite has no 'ADD COLUMN IF NOT
+    EXISTS', so we check the table info first. Used to upgrade old databases.
+    """
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def set_preferences(conn, email, impacts, currencies):
+    """
+    Saves a user's preferences in both places they live: the CSV columns
+    on 'users' (read by the dashboard) and the normalised 'subscriptions'
+    rows (one per currency/impact pair, used for indexed lookups).
+    Bumps and returns the user's settings_version, which lets every web
+    process tell that a cached dashboard row is out of date.
+    The caller commits.
+    """
+    row = conn.execute('''
+        UPDATE users SET impact_pref = ?, currencies_pref = ?, settings_version = COALESCE(settings_version, 0) + 1
+        WHERE email = ?
+        RETURNING settings_version
+    ''', (",".join(impacts), ",".join(currencies), email)).fetchone()
+    conn.execute("DELETE FROM subscriptions WHERE email = ?", (email,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO subscriptions (email, currency, impact) VALUES (?, ?, ?)",
+        [(email, currency, impact) for currency in currencies for impact in impacts]
+    )
+    return row[0] if row else None
+
+def preference_signature(user):
+    """
+    Normalised (impacts, currencies) key for a user's preferences.
+    Users with the same signature see exactly the same events.
+    """
+    impacts = set(_split_csv(user['impact_pref']))
+    currencies = set(_split_csv(user['currencies_pref']))
+    return tuple(sorted(impacts)), tuple(sorted(currencies))
+
+def get_feed_token(conn, email):
+    """
+    Returns the secret token of a user's ICS feed URL, creating it on
+    first use. The caller commits.
+    """
+    row = conn.execute("SELECT feed_token FROM users WHERE email = ?", (email,)).fetchone()
+    if row and row[0]:
+        return row[0]
+    token = secrets.token_urlsafe(24)
+    conn.execute("UPDATE users SET feed_token = ? WHERE email = ?", (token, email))
+    return token
+
+def enqueue_job(conn, kind, email, delay=0):
+    """
+    Queues a background job for one user (see job_worker.py). A job of the
+    same kind already waiting for that user is reused and pushed back by
+    `delay` seconds, so repeated saves collapse into one sync.
+    The caller commits.
+    """
+    conn.execute('''
+        INSERT INTO jobs (kind, email, run_after) VALUES (?, ?, ?)
+        ON CONFLICT (kind, email) WHERE status = 'queued'
+        DO UPDATE SET run_after = excluded.run_after
+    ''', (kind, email, time.time() + delay))
+
+def _split_csv(value):
+    return [part.strip() for part in (value or "").split(',') if part.strip()]
+
+def migrate_db(conn):
+    """
+    Brings an existing database up to SCHEMA_VERSION, tracked in
+    PRAGMA user_version. Each step runs once per database file.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    if version < 1:
+        # 1: Backfill 'subscriptions' from the CSV preference columns
+        users = conn.execute("SELECT email, impact_pref, currencies_pref FROM users").fetchall()
+        for email, impact_pref, currencies_pref in users:
+            set_preferences(conn, email, _split_csv(impact_pref), _split_csv(currencies_pref))
+        logger.info(f"Migrated preferences of {len(users)} users into 'subscriptions'.")
+
+    if version < SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def init_db(db_file=None):
     """
     Initializes the SQLite database structure.
     
     Creates the 'users' table if it does not exist, defining the schema 
-    required to store OAuth credentials and user synchronization preferences.
+    required to store OAuth credentials and user synchronization preferences,
+    plus the 'event_ledger' table the sync worker uses for incremental syncs
+    and the 'event_snapshots' table behind the scraper cache.
+
+    Also switches the file to WAL mode, so the dashboard and a running sync
+    don't block each other, and runs any pending migrate_db() steps.
     """
+    db_file = db_file or DB_FILE
     try:
         # Check if the database file already exists to log the appropriate message
-        db_exists = os.path.exists(DB_FILE)
+        db_exists = os.path.exists(db_file)
 
         # Establish connection to the SQLite database
         # The 'with' statement ensures the connection closes automatically
-        with sqlite3.connect(DB_FILE) as conn:
+        with sqlite3.connect(db_file) as conn:
             cursor = conn.cursor()
 
+            # WAL is a property of the file, so setting it once is enough
+            cursor.execute("PRAGMA journal_mode=WAL")
+
             # Define the schema
             # email: Primary Key (unique identifier for the user)
             # refresh_token: OAuth2 token required for offline access to Google Calendar
@@ -42,17 +145,255 @@ def init_db():
                     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+
+            # Cached OAuth access token (added later, so also migrated in place)
+            # access_token: Fernet-encrypted access token, see calendar_client.py
+            # token_expiry: ISO timestamp (UTC) when that access token expires
+            add_column_if_missing(cursor, 'users', 'access_token', 'TEXT')
+            add_column_if_missing(cursor, 'users', 'token_expiry', 'TEXT')
+
+            # Calendar reconciliation (see sync_worker.reconcile_user)
+            # sync_token: nextSyncToken from the last events.list, for incremental changes
+            # reconciled_at: Unix time of the last full (non-incremental) calendar check
+            add_column_if_missing(cursor, 'users', 'sync_token', 'TEXT')
+            add_column_if_missing(cursor, 'users', 'reconciled_at', 'REAL')
+
+            # Work leases for sharded/resumable sync runs (see sync_worker.claim_users)
+            # claimed_by: Worker ('host:pid') currently holding this user
+            # claimed_until: Unix time the lease expires; expired leases can be re-claimed
+            # last_run_id: The sync run in which this user was last processed
+            add_column_if_missing(cursor, 'users', 'claimed_by', 'TEXT')
+            add_column_if_missing(cursor, 'users', 'claimed_until', 'REAL')
+            add_column_if_missing(cursor, 'users', 'last_run_id', 'TEXT')
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_run_claim ON users (last_run_id, claimed_until)"
+            )
+
+            # ICS subscription feed (see ics_feed.py)
+            # feed_token: Secret token in the user's /feed/<token>.ics URL
+            # delivery: 'api' (events written to Google Calendar) or 'feed' (the user
+            #           subscribes to the ICS feed, so the worker skips them)
+            add_column_if_missing(cursor, 'users', 'feed_token', 'TEXT')
+            add_column_if_missing(cursor, 'users', 'delivery', "TEXT DEFAULT 'api'")
+            # settings_version: Bumped on every settings save (see set_preferences)
+            add_column_if_missing(cursor, 'users', 'settings_version', 'INTEGER DEFAULT 0')
+            cursor.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_feed_token ON users (feed_token)"
+            )
+
+            # One row per sync run, shared by every worker taking part in it
+            # day: The calendar day being synced; only runs for the same day are resumed
+            # status: 'running' until every user has been processed, then 'complete'
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_runs (
+                    run_id TEXT PRIMARY KEY,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+
+            # Ledger of what was last pushed to each user's calendar
+            # event_id: The event's entry from event_ids() (also the Google event ID)
+            # content_hash: SHA-256 of the event body we last sent successfully
+            # remote_updated: Google's 'updated' value returned for that write
+            # pushed_at: When that body was written
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS event_ledger (
+                    email TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    remote_updated TEXT,
+                    pushed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (email, event_id)
+                )
+            ''')
+            add_column_if_missing(cursor, 'event_ledger', 'remote_updated', 'TEXT')
+
+            # Cached scrape results, one row per calendar day
+            # day: ISO date (YYYY-MM-DD)
+            # events_json: JSON list of event dicts as returned by get_data
+            # fetched_at: Unix time of the scrape, compared against the TTLs
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS event_snapshots (
+                    day TEXT PRIMARY KEY,
+                    events_json TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+
+            # Normalised preferences: one row per (user, currency, impact)
+            # Mirrors the CSV columns on 'users'; written by set_preferences()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    email TEXT NOT NULL REFERENCES users(email) ON DELETE CASCADE,
+                    currency TEXT NOT NULL,
+                    impact TEXT NOT NULL,
+                    PRIMARY KEY (email, currency, impact)
+                )
+            ''')
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_subscriptions_currency_impact ON subscriptions (currency, impact)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_subscriptions_impact ON subscriptions (impact)"
+            )
+
+            # Archive of every scraped event, kept forever (see sync_worker.archive_events)
+            # day: ISO date; event_id: event_ids() entry (date-prefixed, so unique per day)
+            # first_seen / updated_at: Unix times of the first and latest scrape that had it
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    day TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    impact TEXT NOT NULL,
+                    time TEXT,
+                    forecast TEXT,
+                    actual TEXT,
+                    first_seen REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (day, currency, event_id)
+                )
+            ''')
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_events_day_currency_impact ON events (day, currency, impact)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_events_day_impact ON events (day, impact)"
+            )
+
+            # Background jobs for single users, processed by job_worker.py
+            # kind: What to do, e.g. 'sync_user'
+            # status: 'queued' -> 'running' -> 'done' (or back to 'queued' to retry, then 'failed')
+            # run_after: Unix time before which the job is not picked up (debounce / retry backoff)
+            # claimed_by / claimed_until: Lease of the worker running it; expired leases are re-claimed
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    run_after REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_by TEXT,
+                    claimed_until REAL,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at REAL
+                )
+            ''')
+            # At most one waiting job per (kind, user): this is what deduplicates
+            cursor.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_queued ON jobs (kind, email) WHERE status = 'queued'"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)"
+            )
+
+            migrate_db(conn)
             
             conn.commit()
 
         if db_exists:
-            logger.info(f"Database '{DB_FILE}' verified. Connection successful.")
+            logger.info(f"Database '{db_file}' verified. Connection successful.")
         else:
-            logger.info(f"Database '{DB_FILE}' created successfully.")
+            logger.info(f"Database '{db_file}' created successfully.")
 
     except sqlite3.Error as e:
         logger.error(f"Critical database error: {e}")
         raise
 
+class PooledConnection:
+    """
+    Thin proxy around a pooled sqlite3 connection. close() hands the
+    connection back to its pool instead of closing it, so existing
+    'conn = get_db_connection() ... conn.close()' code works unchanged.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """Keeps up to `size` idle connections to one database file."""
+
+    def __init__(self, db_file, size=DB_POOL_SIZE):
+        self.db_file = db_file
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        # check_same_thread=False: a connection may be reused by another
+        # thread later, but is only ever used by one thread at a time
+        conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def get(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        # Never hand out a connection with someone else's open transaction
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_db_connection(db_file=None):
+    """
+    Returns a pooled connection (rows as sqlite3.Row) to `db_file`.
+    Call close() or use it as a context manager to return it to the pool.
+    """
+    db_file = db_file or DB_FILE
+    with _pools_lock:
+        if db_file not in _pools:
+            _pools[db_file] = ConnectionPool(db_file)
+        pool = _pools[db_file]
+    return pool.get()
+
+def close_pool(db_file=None):
+    """Closes the idle pooled connections to `db_file` and forgets its pool."""
+    db_file = db_file or DB_FILE
+    with _pools_lock:
+        pool = _pools.pop(db_file, None)
+    if pool:
+        pool.close_all()
+
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
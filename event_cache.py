@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import datetime
+import logging
+import threading
+import dotenv
+from zoneinfo import ZoneInfo
+
+from get_data import fetch_events, ScrapeError
+import database
+
+dotenv.load_dotenv()
+
+# --- CONFIGURATION ---
+DB_FILE = os.environ.get('DB_FILE', 'users.db')
+
+# "Today" is taken in the zone the scraped times are in (see sync_worker.SERVER_TIMEZONE),
+# which need not be the host's zone
+SERVER_TIMEZONE = os.environ.get('SCRAPER_TIMEZONE', 'Africa/Johannesburg')
+
+# How long (seconds) a snapshot is trusted before we scrape again.
+# Past days rarely change, today changes as 'actual' values come in,
+# and future days only change when ForexFactory reschedules something.
+SNAPSHOT_TTL_PAST = int(os.environ.get('SNAPSHOT_TTL_PAST', str(7 * 24 * 3600)))
+SNAPSHOT_TTL_TODAY = int(os.environ.get('SNAPSHOT_TTL_TODAY', '600'))
+SNAPSHOT_TTL_FUTURE = int(os.environ.get('SNAPSHOT_TTL_FUTURE', str(6 * 3600)))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def get_db_connection():
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            database.init_db(DB_FILE)
+            _schema_ready = True
+    return database.get_db_connection(DB_FILE)
+
+def server_today():
+    """Today's date in SERVER_TIMEZONE."""
+    return datetime.datetime.now(ZoneInfo(SERVER_TIMEZONE)).date()
+
+def snapshot_ttl(day, today=None):
+    """Returns the TTL in seconds that applies to a snapshot of `day`."""
+    today = today or server_today()
+    if day < today:
+        return SNAPSHOT_TTL_PAST
+    if day == today:
+        return SNAPSHOT_TTL_TODAY
+    return SNAPSHOT_TTL_FUTURE
+
+def load_snapshot(day):
+    """Returns (events, fetched_at) for `day`, or None if it was never scraped."""
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT events_json, fetched_at FROM event_snapshots WHERE day = ?", (day.isoformat(),)
+    ).fetchone()
+    conn.close()
+
+    if not row:
+        return None
+    return json.loads(row[0]), row[1]
+
+def save_snapshots(events_by_day, fetched_at=None):
+    """Stores one snapshot per day. `events_by_day` maps date -> list of events."""
+    fetched_at = fetched_at or time.time()
+    conn = get_db_connection()
+    conn.executemany('''
+        INSERT INTO event_snapshots (day, events_json, fetched_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            events_json = excluded.events_json,
+            fetched_at = excluded.fetched_at
+    ''', [(day.isoformat(), json.dumps(events), fetched_at) for day, events in events_by_day.items()])
+    conn.commit()
+    conn.close()
+
+def week_days(day):
+    """The Sunday-Saturday week ForexFactory shows for `day`."""
+    sunday = day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+    return [sunday + datetime.timedelta(days=i) for i in range(7)]
+
+def _split_by_day(events, days=None):
+    """
+    Groups events by their parsed 'date'. With `days`, exactly those days
+    are returned (empty ones included); without, only the dates present.
+    """
+    events_by_day = {day: [] for day in days or ()}
+    for event in events:
+        day = datetime.date.fromisoformat(event['date'])
+        if days is None or day in events_by_day:
+            events_by_day.setdefault(day, []).append(event)
+    return events_by_day
+
+def refresh_day(day=None):
+    """
+    Scrapes one day, stores it and returns its events. Raises ScrapeError.
+
+    Rows are stored under the dates parsed from the page, and a day the
+    page did not contain is never overwritten, so a page that turns out to
+    show another date cannot wipe a good snapshot.
+    """
+    day = day or server_today()
+
+    # Always the dated URL: ForexFactory's '?day=today' need not be our today
+    events = fetch_events(day)
+    events_by_day = _split_by_day(events)
+    if not events:
+        events_by_day[day] = []  # The page for `day` is simply quiet
+    save_snapshots(events_by_day)
+
+    if day not in events_by_day:
+        found = ', '.join(str(d) for d in sorted(events_by_day))
+        raise ScrapeError(f"The page for {day} only had rows for {found}")
+    return events_by_day[day]
+
+def refresh_week(day=None):
+    """Scrapes the whole week containing `day` in one request. Raises ScrapeError."""
+    day = day or server_today()
+    days = week_days(day)
+    events_by_day = _split_by_day(fetch_events(day, week=True), days)
+    save_snapshots(events_by_day)
+    return events_by_day
+
+def get_events(day=None, max_age=None):
+    """
+    Returns the events for `day` (default: server_today()), scraping only when the
+    snapshot is older than its TTL. Pass max_age to override the TTL
+    (max_age=0 forces a fresh scrape).
+
+    If the scrape fails, a stale snapshot is better than nothing and is
+    returned with a warning; with no snapshot at all, returns [].
+    """
+    day = day or server_today()
+    ttl = snapshot_ttl(day) if max_age is None else max_age
+
+    snapshot = load_snapshot(day)
+    if snapshot and time.time() - snapshot[1] <= ttl:
+        logger.info(f"Using cached events for {day} ({len(snapshot[0])} events).")
+        return snapshot[0]
+
+    try:
+        logger.info(f"Snapshot for {day} is missing or stale. Scraping...")
+        return refresh_day(day)
+    except ScrapeError as e:
+        if snapshot:
+            logger.warning(f"Scrape failed ({e}). Using stale snapshot for {day}.")
+            return snapshot[0]
+        logger.error(f"Scrape failed ({e}) and no snapshot exists for {day}.")
+        return []
+
+def get_week(day=None, max_age=None):
+    """
+    Returns {date: events} for `day` (default: today) and the six days
+    after it. Stale days are refreshed with one week-page scrape per
+    Sunday-Saturday week they fall in, so at most two requests.
+    """
+    day = day or server_today()
+    now = time.time()
+
+    events_by_day = {}
+    stale_weeks = []  # The Sunday of each week that has a stale day
+    for d in (day + datetime.timedelta(days=i) for i in range(7)):
+        snapshot = load_snapshot(d)
+        ttl = snapshot_ttl(d) if max_age is None else max_age
+        if not snapshot or now - snapshot[1] > ttl:
+            sunday = week_days(d)[0]
+            if sunday not in stale_weeks:
+                stale_weeks.append(sunday)
+        events_by_day[d] = snapshot[0] if snapshot else []
+
+    for sunday in stale_weeks:
+        try:
+            logger.info(f"Week of {sunday} is stale. Scraping week view...")
+            fresh = refresh_week(sunday)
+        except ScrapeError as e:
+            logger.warning(f"Week scrape failed ({e}). Using cached snapshots for the week of {sunday}.")
+            continue
+        events_by_day.update((d, events) for d, events in fresh.items() if d in events_by_day)
+
+    return events_by_day
+
+# Usage: python event_cache.py [--week]
+# Warms the cache by hand; the daily sync run also keeps the week ahead warm.
+if __name__ == "__main__":
+    if "--week" in sys.argv:
+        for day, events in get_week(max_age=0).items():
+            print(f"{day}: {len(events)} events")
+    else:
+        print(f"{server_today()}: {len(get_events(max_age=0))} events")
@@ -1,12 +1,228 @@
-import time
 import os
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
+import re
+import sys
+import datetime
+import atexit
+import threading
+from contextlib import contextmanager
+
+# Scraping libraries are imported inside the functions that use them, so a
+# worker answered from the snapshot cache never loads them. Selenium and
+# webdriver_manager are only needed when the HTTP backend fails; the HTTP
+# backend itself is optional (requests + lxml), falling back to Selenium.
+
+# --- CONFIGURATION ---
+CALENDAR_URL = "https://www.forexfactory.com/calendar"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Which backend to try first: 'http' (fast, no browser) or 'selenium'
+SCRAPER_BACKEND = os.environ.get('SCRAPER_BACKEND', 'http')
+HTTP_TIMEOUT = 15
+
+# Warm browser pool (Selenium backend)
+DRIVER_POOL_SIZE = int(os.environ.get('DRIVER_POOL_SIZE', '1'))
+DRIVER_MAX_USES = int(os.environ.get('DRIVER_MAX_USES', '50'))
+PAGE_LOAD_TIMEOUT = 15
+
+_driver_path = None
+_driver_pool = None
+_driver_lock = threading.Lock()
+
+class ScrapeError(Exception):
+    """Raised when a backend could not read the calendar table at all."""
+
+# --- SHARED PARSING ---
+def calendar_url(day=None, week=False):
+    """
+    Builds the ForexFactory URL for one day (default: today) or, with
+    week=True, for the Sunday-Saturday week containing that day.
+    """
+    if day is None and not week:
+        return f"{CALENDAR_URL}?day=today"
+
+    day = day or datetime.date.today()
+    param = f"{day.strftime('%b').lower()}{day.day}.{day.year}"
+    return f"{CALENDAR_URL}?{'week' if week else 'day'}={param}"
+
+def parse_row_date(date_text, anchor):
+    """
+    Turns the 'Fri Oct 16' text of a calendar__date cell into a date.
+    The page has no year, so we pick the one closest to the requested day.
+    """
+    match = re.search(r"([A-Za-z]{3})\s*(\d{1,2})\s*$", date_text or "")
+    if not match:
+        return None
+
+    month_day = f"{match.group(1).title()} {match.group(2)}"
+    candidates = []
+    for year in (anchor.year - 1, anchor.year, anchor.year + 1):
+        try:
+            candidates.append(datetime.datetime.strptime(f"{month_day} {year}", "%b %d %Y").date())
+        except ValueError:
+            continue
+    if not candidates:
+        return None
+    return min(candidates, key=lambda d: abs((d - anchor).days))
+
+def classify_impact(impact_class):
+    """Maps the CSS class of the impact icon to 'High', 'Medium' or 'Low'."""
+    impact_class = (impact_class or "").lower()
+    if "high" in impact_class or "red" in impact_class:
+        return "High"
+    if "medium" in impact_class or "ora" in impact_class:
+        return "Medium"
+    return "Low"
+
+def normalise_row(fields):
+    """
+    Turns the raw text of one calendar row into an event dict.
+    Returns None for rows without a title and for Low impact events.
+    """
+    event_name = (fields.get("event") or "").strip()
+    if not event_name:
+        return None
+
+    impact = classify_impact(fields.get("impact_class"))
+
+    # Filter: High and Medium only
+    if impact not in ["High", "Medium"]:
+        return None
+
+    return {
+        "currency": (fields.get("currency") or "").strip(),
+        "event": event_name,
+        "impact": impact,
+        "actual": (fields.get("actual") or "").strip(),
+        "forecast": (fields.get("forecast") or "").strip(),
+        "time": (fields.get("time") or "").strip(),
+        "date": fields.get("date") or ""
+    }
+
+def rows_to_events(rows, anchor):
+    """
+    Normalises raw row dicts from any backend into event dicts.
+    ForexFactory only prints the date on the first row of each day and the
+    time on the first row of each time slot, so both are carried forward;
+    rows before the first date get the anchor day.
+    """
+    current_day = anchor
+    current_time = ""
+    events = []
+    for fields in rows:
+        row_day = parse_row_date(fields.get("date_text"), anchor)
+        if row_day:
+            current_day = row_day
+            current_time = ""
+        row_time = (fields.get("time") or "").strip()
+        if row_time:
+            current_time = row_time
+
+        event = normalise_row(dict(fields, date=current_day.isoformat(), time=current_time))
+        if event:
+            events.append(event)
+
+    return events
+
+def parse_calendar_html(page_html, anchor=None):
+    """
+    Extracts High/Medium impact events from ForexFactory calendar markup.
+    Works on a live response or a saved HTML file (see fixtures/).
+    `anchor` is the day that was requested (default: today).
+    """
+    try:
+        from lxml import html as lxml_html
+    except ImportError:
+        raise ScrapeError("lxml is not installed")
+
+    tree = lxml_html.fromstring(page_html)
+    rows = tree.xpath("//tr[contains(@class, 'calendar__row')]")
+    if not rows:
+        # Usually a bot-check page rather than a quiet day
+        raise ScrapeError("No calendar rows found in page")
+
+    def cell_text(row, class_name):
+        cells = row.xpath(f".//*[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]")
+        return cells[0].text_content().strip() if cells else ""
+
+    raw_rows = []
+    for row in rows:
+        impact_spans = row.xpath(
+            ".//*[contains(concat(' ', normalize-space(@class), ' '), ' calendar__impact ')]//span"
+        )
+        raw_rows.append({
+            "date_text": cell_text(row, "calendar__date"),
+            "event": cell_text(row, "calendar__event-title"),
+            "currency": cell_text(row, "calendar__currency"),
+            "actual": cell_text(row, "calendar__actual"),
+            "forecast": cell_text(row, "calendar__forecast"),
+            "time": cell_text(row, "calendar__time"),
+            "impact_class": impact_spans[0].get("class", "") if impact_spans else ""
+        })
+
+    return rows_to_events(raw_rows, anchor or datetime.date.today())
+
+# --- BACKEND 1: Plain HTTP ---
+def scrape_http(url, anchor):
+    """Fetches the calendar page with a single GET request and parses it with lxml."""
+    try:
+        import requests
+    except ImportError:
+        raise ScrapeError("HTTP backend needs 'requests' (and 'lxml' to parse)")
+
+    print("Accessing ForexFactory (HTTP)...")
+    response = requests.get(
+        url,
+        headers={"User-Agent": USER_AGENT, "Accept-Language": "en-US,en;q=0.9"},
+        timeout=HTTP_TIMEOUT
+    )
+    if response.status_code != 200:
+        raise ScrapeError(f"HTTP {response.status_code} from ForexFactory")
+
+    return parse_calendar_html(response.text, anchor)
+
+# --- BACKEND 2: Headless Chrome ---
+# Runs inside the page and returns the raw fields of every calendar row,
+# so the whole table costs one WebDriver call instead of ~7 per row.
+# innerText matches what Selenium's element.text would have returned.
+EXTRACT_ROWS_JS = """
+const text = (row, cls) => {
+    const el = row.querySelector('.' + cls);
+    return el ? (el.innerText || '').trim() : '';
+};
+return Array.from(document.querySelectorAll("tr[class*='calendar__row']")).map(row => {
+    const impact = row.querySelector('.calendar__impact span');
+    return {
+        date_text: text(row, 'calendar__date'),
+        event: text(row, 'calendar__event-title'),
+        currency: text(row, 'calendar__currency'),
+        actual: text(row, 'calendar__actual'),
+        forecast: text(row, 'calendar__forecast'),
+        time: text(row, 'calendar__time'),
+        impact_class: impact ? (impact.getAttribute('class') || '') : ''
+    };
+});
+"""
+
+def _resolve_driver_path():
+    """
+    Returns the chromedriver binary to use. ChromeDriverManager().install()
+    hits the network, so its result is resolved once per process.
+    """
+    global _driver_path
+    with _driver_lock:
+        if _driver_path is None:
+            if "PYTHONANYWHERE_DOMAIN" in os.environ:
+                _driver_path = "/usr/bin/chromedriver"
+            else:
+                from webdriver_manager.chrome import ChromeDriverManager
+                _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+def _start_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
 
-def get_forex_events():
     # --- 1. SETUP ---
     chrome_options = Options()
     
@@ -18,90 +234,185 @@ def get_forex_events():
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     # Fake user agent
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
 
     # --- SMART DRIVER SELECTION ---
     # This block detects if we are on PythonAnywhere or Local Laptop
-    try:
-        if "PYTHONANYWHERE_DOMAIN" in os.environ:
-            # We are on the Server! Use their pre-installed Chrome.
-            print("Detecting PythonAnywhere environment...")
-            chrome_options.binary_location = "/usr/bin/chromium-browser"
-            service = Service("/usr/bin/chromedriver")
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-        else:
-            # We are on the Laptop! Use the automatic manager.
-            print("Running locally...")
-            service = Service(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            
-    except Exception as e:
-        print(f"Failed to initialize Chrome Driver: {e}")
-        return []
+    if "PYTHONANYWHERE_DOMAIN" in os.environ:
+        # We are on the Server! Use their pre-installed Chrome.
+        print("Detecting PythonAnywhere environment...")
+        chrome_options.binary_location = "/usr/bin/chromium-browser"
+    else:
+        # We are on the Laptop! Use the automatic manager.
+        print("Running locally...")
 
-    events = []
-    
+    service = Service(_resolve_driver_path())
+    return webdriver.Chrome(service=service, options=chrome_options)
+
+class DriverPool:
+    """
+    Keeps up to `size` headless Chrome sessions warm between scrapes.
+
+    A session is retired after `max_uses` scrapes, or straight away if the
+    code using it raises a WebDriverException (crashed tab, dead session).
+    An idle session whose Chrome died between scrapes is only found out when
+    it is used, so driver(url) replaces it and loads the page once more.
+    """
+
+    def __init__(self, size=1, max_uses=50):
+        self.max_uses = max_uses
+        self._idle = []  # [(driver, uses)]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def driver(self, url=None):
+        """Lends a browser, with `url` already loaded if one is given."""
+        from selenium.common.exceptions import WebDriverException
+
+        self._slots.acquire()
+        try:
+            with self._lock:
+                driver, uses = self._idle.pop() if self._idle else (None, 0)
+
+            loaded = False
+            if driver is not None and url:
+                try:
+                    driver.get(url)
+                    loaded = True
+                except WebDriverException as e:
+                    print(f"Pooled browser failed ({e.__class__.__name__}), retrying with a fresh one...")
+                    self._quit(driver)
+                    driver, uses = None, 0
+                except BaseException:
+                    self._release(driver, uses + 1)
+                    raise
+            if driver is None:
+                driver = _start_driver()
+
+            try:
+                if url and not loaded:
+                    driver.get(url)
+                yield driver
+            except WebDriverException:
+                self._quit(driver)
+                raise
+            except BaseException:
+                self._release(driver, uses + 1)
+                raise
+            else:
+                self._release(driver, uses + 1)
+        finally:
+            self._slots.release()
+
+    def _release(self, driver, uses):
+        if uses >= self.max_uses:
+            self._quit(driver)
+            return
+        with self._lock:
+            self._idle.append((driver, uses))
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """Quits every idle browser. Called automatically at exit."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver, _ in idle:
+            self._quit(driver)
+
+def get_driver_pool():
+    """Returns the process-wide DriverPool, creating it on first use."""
+    global _driver_pool
+    with _driver_lock:
+        if _driver_pool is None:
+            _driver_pool = DriverPool(size=DRIVER_POOL_SIZE, max_uses=DRIVER_MAX_USES)
+            atexit.register(_driver_pool.close)
+        return _driver_pool
+
+def scrape_selenium(url, anchor):
+    """Scrapes the calendar with a warm browser from the DriverPool."""
     try:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
         # --- 2. FETCH PAGE ---
         print("Accessing ForexFactory...")
-        driver.get("https://www.forexfactory.com/calendar?day=today")
-        time.sleep(3) # Wait for page to load
+        with get_driver_pool().driver(url) as driver:
 
-        # --- 3. EXTRACT DATA ---
-        rows = driver.find_elements(By.XPATH, "//tr[contains(@class, 'calendar__row')]")
-        
-        for row in rows:
-            try:
-                # Get Event Name
-                event_name = row.find_element(By.CLASS_NAME, "calendar__event-title").text
-                if not event_name: 
-                    continue
-
-                # Get basic info
-                currency = row.find_element(By.CLASS_NAME, "calendar__currency").text
-                actual = row.find_element(By.CLASS_NAME, "calendar__actual").text
-                forecast = row.find_element(By.CLASS_NAME, "calendar__forecast").text
-                time_str = row.find_element(By.CLASS_NAME, "calendar__time").text
-                
-                # Check impact color
-                impact_element = row.find_element(By.CLASS_NAME, "calendar__impact").find_element(By.TAG_NAME, "span")
-                impact_class = impact_element.get_attribute("class").lower()
-                
-                impact = "Low"
-                if "high" in impact_class or "red" in impact_class:
-                    impact = "High"
-                elif "medium" in impact_class or "ora" in impact_class:
-                    impact = "Medium"
-
-                # Filter: High and Medium only
-                if impact in ["High", "Medium"]:
-                    events.append({
-                        "currency": currency,
-                        "event": event_name,
-                        "impact": impact,
-                        "actual": actual,
-                        "forecast": forecast,
-                        "time": time_str
-                    })
-            except:
-                continue
+            # Wait until the table is actually there instead of a fixed sleep
+            WebDriverWait(driver, PAGE_LOAD_TIMEOUT).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "tr[class*='calendar__row']"))
+            )
+
+            # --- 3. EXTRACT DATA ---
+            # One round trip: the browser returns every row as a plain dict
+            rows = driver.execute_script(EXTRACT_ROWS_JS) or []
 
     except Exception as e:
-        print(f"Error occurred during scraping: {e}")
-    finally:
-        # Always close the browser to save memory
-        driver.quit()
-        
-    return events
+        raise ScrapeError(f"Error occurred during scraping: {e}") from e
+
+    return rows_to_events(rows, anchor)
+
+BACKENDS = {
+    "http": scrape_http,
+    "selenium": scrape_selenium
+}
+
+def fetch_events(day=None, week=False, backend=None):
+    """
+    Scrapes one day (default: today) or, with week=True, the whole week
+    containing it. Every event carries an ISO 'date'.
+
+    Tries the configured backend first (SCRAPER_BACKEND, default 'http') and
+    falls back to Selenium if it fails, e.g. when the plain request is blocked.
+    Raises ScrapeError if every backend fails, so callers can tell a failed
+    scrape from a quiet day.
+    """
+    backend = backend or SCRAPER_BACKEND
+    if backend not in BACKENDS:
+        print(f"Unknown scraper backend '{backend}', using selenium.")
+        backend = "selenium"
+
+    url = calendar_url(day, week)
+    anchor = day or datetime.date.today()
+
+    order = [backend] if backend == "selenium" else [backend, "selenium"]
+    for name in order:
+        try:
+            return BACKENDS[name](url, anchor)
+        except Exception as e:
+            print(f"Scraper backend '{name}' failed: {e}")
+
+    raise ScrapeError("All scraper backends failed")
+
+def get_forex_events(day=None, week=False, backend=None):
+    """Like fetch_events(), but returns [] instead of raising on failure."""
+    try:
+        return fetch_events(day, week, backend)
+    except ScrapeError:
+        return []
 
 # Test block
+# Usage: python get_data.py [saved_calendar.html]
 if __name__ == "__main__":
     print("Running scraper test...")
-    data = get_forex_events()
+    if len(sys.argv) > 1:
+        # Offline mode: parse a saved page instead of hitting ForexFactory
+        with open(sys.argv[1], encoding="utf-8") as f:
+            data = parse_calendar_html(f.read())
+    else:
+        data = get_forex_events()
     
     if not data:
         print("No High/Medium impact events found today.")
     else:
         print(f"Success! Found {len(data)} events:")
         for item in data:
-            print(f"[{item['time']}] {item['currency']} - {item['event']} ({item['impact']})")
\ No newline at end of file
+            print(f"[{item['time']}] {item['currency']} - {item['event']} ({item['impact']})")
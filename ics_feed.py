@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import datetime
+import threading
+import dotenv
+from zoneinfo import ZoneInfo
+
+import database
+from sync_worker import (
+    SERVER_TIMEZONE,
+    build_event_records,
+    filter_for_signature,
+    index_events
+)
+
+# Load environment variables
+dotenv.load_dotenv()
+
+# --- CONFIGURATION ---
+DB_FILE = os.environ.get('DB_FILE', 'users.db')
+
+# Days of snapshots included in a feed, before and after today
+FEED_PAST_DAYS = int(os.environ.get('FEED_PAST_DAYS', '7'))
+FEED_FUTURE_DAYS = int(os.environ.get('FEED_FUTURE_DAYS', '7'))
+
+# Hint to calendar apps on how often to re-fetch (RFC 7986 REFRESH-INTERVAL)
+FEED_REFRESH_INTERVAL = 'PT1H'
+
+# signature -> (version, body, etag); plus the records built for one version
+_feed_cache = {}
+_records_cache = {'version': None, 'records': [], 'index': {}}
+_cache_lock = threading.Lock()
+
+def _feed_days(today=None):
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=FEED_PAST_DAYS), today + datetime.timedelta(days=FEED_FUTURE_DAYS))
+
+def snapshot_version(conn, first_day, last_day):
+    """Changes whenever a snapshot inside the window is (re)scraped."""
+    row = conn.execute('''
+        SELECT COUNT(*), MAX(fetched_at) FROM event_snapshots WHERE day BETWEEN ? AND ?
+    ''', (first_day.isoformat(), last_day.isoformat())).fetchone()
+    return (first_day, row[0], row[1])
+
+def load_records(conn, first_day, last_day):
+    """Every cached event inside the window, as EventRecords in date order."""
+    rows = conn.execute('''
+        SELECT events_json FROM event_snapshots WHERE day BETWEEN ? AND ? ORDER BY day
+    ''', (first_day.isoformat(), last_day.isoformat())).fetchall()
+    return build_event_records([event for row in rows for event in json.loads(row[0])])
+
+# --- ICS RENDERING ---
+def escape_text(value):
+    """Escapes a TEXT value per RFC 5545 section 3.3.11."""
+    return (
+        str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+def fold_line(line):
+    """Splits a content line into 75-octet pieces joined by CRLF + space."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(data))
+        # Never split a multi-byte UTF-8 character
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+    return '\r\n '.join(parts)
+
+def _ics_time(when):
+    """'DTSTART...' parameters and value for a Calendar API start/end dict."""
+    if 'date' in when:
+        return ';VALUE=DATE', when['date'].replace('-', '')
+    local = datetime.datetime.fromisoformat(when['dateTime'])
+    if local.tzinfo is None:
+        local = local.replace(tzinfo=ZoneInfo(when.get('timeZone') or SERVER_TIMEZONE))
+    return '', local.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def render_ics(records, stamp):
+    """An iCalendar (RFC 5545) document for `records`; `stamp` is the DTSTAMP."""
+    dtstamp = stamp.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Forex Calendar Sync//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:Forex Calendar',
+        f'REFRESH-INTERVAL;VALUE=DURATION:{FEED_REFRESH_INTERVAL}',
+        f'X-PUBLISHED-TTL:{FEED_REFRESH_INTERVAL}'
+    ]
+    for record in records:
+        body = record.body
+        start_params, start = _ics_time(body['start'])
+        end_params, end = _ics_time(body['end'])
+        if end_params and end <= start:
+            # A DATE-valued DTEND is exclusive, so a one-day event ends the next day
+            next_day = datetime.datetime.strptime(start, '%Y%m%d') + datetime.timedelta(days=1)
+            end = next_day.strftime('%Y%m%d')
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:{record.event_id}@forex-calendar",
+            f"DTSTAMP:{dtstamp}",
+            f"DTSTART{start_params}:{start}",
+            f"DTEND{end_params}:{end}",
+            f"SUMMARY:{escape_text(body['summary'])}",
+            f"DESCRIPTION:{escape_text(body['description'])}",
+            f"CATEGORIES:{escape_text(record.currency)},{escape_text(record.impact)}",
+            'TRANSP:TRANSPARENT',
+            'END:VEVENT'
+        ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(fold_line(line) for line in lines) + '\r\n'
+
+# --- CACHED FEEDS ---
+def get_feed(signature):
+    """
+    Returns (ics_body, etag) for a preference signature. The feed is
+    rendered once per signature and snapshot version, so every subscriber
+    with the same preferences shares one cached document.
+    """
+    first_day, last_day = _feed_days()
+    conn = database.get_db_connection(DB_FILE)
+    try:
+        version = snapshot_version(conn, first_day, last_day)
+
+        with _cache_lock:
+            cached = _feed_cache.get(signature)
+            if cached and cached[0] == version:
+                return cached[1], cached[2]
+
+            if _records_cache['version'] != version:
+                records = load_records(conn, first_day, last_day)
+                _records_cache.update(version=version, records=records, index=index_events(records))
+                _feed_cache.clear()
+            records, index = _records_cache['records'], _records_cache['index']
+    finally:
+        conn.close()
+
+    # DTSTAMP comes from the scrape time, so identical input gives an identical ETag
+    stamp = datetime.datetime.fromtimestamp(version[2] or 0, datetime.timezone.utc)
+    body = render_ics(filter_for_signature(signature, records, index), stamp)
+    etag = hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+
+    with _cache_lock:
+        if _records_cache['version'] == version:
+            _feed_cache[signature] = (version, body, etag)
+    return body, etag
+
+def get_user_feed(user):
+    """The cached feed for a users row (needs impact_pref and currencies_pref)."""
+    return get_feed(database.preference_signature(user))
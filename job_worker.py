@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import logging
+import dotenv
+
+from event_cache import get_events
+from sync_worker import (
+    WORKER_ID,
+    build_event_records,
+    clear_user,
+    event_day,
+    filter_for_signature,
+    get_db_connection,
+    group_users,
+    index_events,
+    run_user_jobs
+)
+
+# Load environment variables
+dotenv.load_dotenv()
+
+# --- CONFIGURATION ---
+# Seconds between polls of an empty queue
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+# Jobs claimed (and synced in parallel) per round
+JOB_CLAIM_BATCH = int(os.environ.get('JOB_CLAIM_BATCH', '20'))
+# Seconds a claimed job is held before another worker may take it over
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+# Attempts before a job is marked 'failed'
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+# Finished jobs are kept this many days for inspection
+JOB_RETENTION_DAYS = 7
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def claim_jobs(limit=None, lease_seconds=None):
+    """
+    Leases up to `limit` due jobs: queued ones whose run_after has passed,
+    and running ones whose worker let the lease expire.
+    """
+    limit = limit or JOB_CLAIM_BATCH
+    lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+    now = time.time()
+
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        jobs = conn.execute('''
+            SELECT * FROM jobs
+            WHERE (status = 'queued' AND run_after <= ?)
+               OR (status = 'running' AND claimed_until < ?)
+            ORDER BY run_after
+            LIMIT ?
+        ''', (now, now, limit)).fetchall()
+        conn.executemany('''
+            UPDATE jobs SET status = 'running', claimed_by = ?, claimed_until = ?, attempts = attempts + 1
+            WHERE id = ?
+        ''', [(WORKER_ID, now + lease_seconds, job['id']) for job in jobs])
+        conn.commit()
+    finally:
+        conn.close()
+    return jobs
+
+def renew_job_leases(job_ids, lease_seconds=None):
+    """
+    Extends this worker's lease on running jobs, so a slow batch is not
+    re-claimed by another worker while it is still syncing those users.
+    Returns how many leases were still held.
+    """
+    lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+    job_ids = list(job_ids)
+    conn = get_db_connection()
+    renewed = conn.execute(f'''
+        UPDATE jobs SET claimed_until = ?
+        WHERE status = 'running' AND claimed_by = ? AND id IN ({','.join('?' * len(job_ids))})
+    ''', [time.time() + lease_seconds, WORKER_ID] + job_ids).rowcount
+    conn.commit()
+    conn.close()
+    if renewed < len(job_ids):
+        logger.warning(f"Lost the lease on {len(job_ids) - renewed} jobs; another worker may run them too.")
+    return renewed
+
+def finish_job(job, error=None):
+    """
+    Marks a job done, or re-queues it with backoff until JOB_MAX_ATTEMPTS.
+    Does nothing if this worker no longer holds the job's lease (the worker
+    that took it over records the outcome). Returns True if it was recorded.
+    """
+    conn = get_db_connection()
+    if error is None:
+        recorded = conn.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, last_error = NULL WHERE id = ? AND claimed_by = ?",
+            (time.time(), job['id'], WORKER_ID)
+        ).rowcount
+    elif job['attempts'] + 1 >= JOB_MAX_ATTEMPTS:
+        recorded = conn.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, last_error = ? WHERE id = ? AND claimed_by = ?",
+            (time.time(), error, job['id'], WORKER_ID)
+        ).rowcount
+        if recorded:
+            logger.error(f"Job {job['id']} ({job['kind']} {job['email']}) failed for good: {error}")
+    else:
+        delay = min(3600, 30 * 2 ** job['attempts'])
+        recorded = conn.execute('''
+            UPDATE jobs SET status = 'queued', run_after = ?, claimed_by = NULL, claimed_until = NULL, last_error = ?
+            WHERE id = ? AND claimed_by = ? AND NOT EXISTS (
+                SELECT 1 FROM jobs WHERE kind = ? AND email = ? AND status = 'queued'
+            )
+        ''', (time.time() + delay, error, job['id'], WORKER_ID, job['kind'], job['email'])).rowcount
+        if not recorded:
+            # A newer job for the same user is already waiting and will do the same work
+            recorded = conn.execute(
+                "UPDATE jobs SET status = 'superseded', finished_at = ?, last_error = ? WHERE id = ? AND claimed_by = ?",
+                (time.time(), error, job['id'], WORKER_ID)
+            ).rowcount
+    conn.commit()
+    conn.close()
+    if not recorded:
+        logger.warning(f"Lost the lease on job {job['id']} ({job['email']}); leaving it to the worker that took it over.")
+    return bool(recorded)
+
+def prune_jobs():
+    conn = get_db_connection()
+    conn.execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed', 'superseded') AND finished_at < ?",
+        (time.time() - JOB_RETENTION_DAYS * 86400,)
+    )
+    conn.commit()
+    conn.close()
+
+def run_sync_jobs(jobs, max_workers=None):
+    """
+    Runs a batch of 'sync_user' jobs: today's events are prepared once and
+    each user gets the ones matching their current preferences. Events they
+    no longer want are deleted by sync_user(), since today is fully covered.
+    Users on the ICS feed get the events pushed earlier removed instead, so
+    the feed does not show them twice. The jobs' leases are renewed while
+    the batch runs.
+    """
+    emails = [job['email'] for job in jobs]
+    conn = get_db_connection()
+    users = conn.execute(
+        f"SELECT * FROM users WHERE email IN ({','.join('?' * len(emails))})", emails
+    ).fetchall()
+    conn.close()
+
+    # Throttling or first-time full checks can stretch a batch past its lease
+    pending = {job['email']: job['id'] for job in jobs}
+    renewed_at = time.monotonic()
+
+    def on_result(result):
+        nonlocal renewed_at
+        pending.pop(result['email'], None)
+        if pending and time.monotonic() - renewed_at > JOB_LEASE_SECONDS / 3:
+            renew_job_leases(pending.values())
+            renewed_at = time.monotonic()
+
+    feed_users = [user for user in users if (user['delivery'] or 'api') == 'feed']
+    users = [user for user in users if (user['delivery'] or 'api') != 'feed']
+    results = {}
+    for user in feed_users:
+        results[user['email']] = clear_user(user)
+        on_result(results[user['email']])
+
+    all_events = get_events() if users else []
+    if users and not all_events:
+        raise RuntimeError("No events available (scrape failed and nothing is cached)")
+
+    records = build_event_records(all_events)
+    index = index_events(records)
+    days = {event_day(event) for event in all_events}
+
+    sync_jobs = []
+    for signature, group in group_users(users).items():
+        group_records = filter_for_signature(signature, records, index)
+        sync_jobs.extend((user, group_records) for user in group)
+
+    results.update((result['email'], result) for result in run_user_jobs(sync_jobs, max_workers, on_result, days))
+    return results
+
+def process_jobs(max_workers=None):
+    """Claims and runs one batch of jobs. Returns how many were claimed."""
+    jobs = claim_jobs()
+    if not jobs:
+        return 0
+
+    logger.info(f"Claimed {len(jobs)} jobs.")
+    sync_jobs = [job for job in jobs if job['kind'] == 'sync_user']
+    for job in jobs:
+        if job['kind'] != 'sync_user':
+            finish_job(job, f"Unknown job kind '{job['kind']}'")
+
+    try:
+        results = run_sync_jobs(sync_jobs, max_workers) if sync_jobs else {}
+    except Exception as e:
+        logger.error(f"Job batch failed: {e}")
+        for job in sync_jobs:
+            finish_job(job, str(e))
+        return len(jobs)
+
+    for job in sync_jobs:
+        result = results.get(job['email'])
+        # A user deleted since the job was queued has nothing to do
+        error = result.get('error') if result and result['status'] == 'error' else None
+        finish_job(job, error)
+    return len(jobs)
+
+def run_job_worker(once=False, max_workers=None):
+    """
+    Long-running mode: polls the jobs table and syncs single users as soon
+    as their job is due. With once=True, drains the queue and returns.
+    """
+    logger.info("--- Starting Job Worker ---")
+    prune_jobs()
+    try:
+        while True:
+            if process_jobs(max_workers):
+                continue
+            if once:
+                break
+            time.sleep(JOB_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        logger.info("--- Job Worker Stopped ---")
+
+# Usage: python job_worker.py [--once]
+if __name__ == "__main__":
+    run_job_worker(once="--once" in sys.argv)
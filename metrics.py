@@ -0,0 +1,208 @@
+import os
+import re
+import glob
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+class Gauge(Counter):
+    """A value that can go up and down (e.g. last run timestamp)."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[_labels_key(labels)] = value
+
+class Histogram:
+    """Cumulative bucket counts plus sum/count per label set."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for key, series in self.values.items():
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket", key + (('le', _format_value(bound)),), count
+            yield f"{self.name}_bucket", key + (('le', '+Inf'),), series[-1]
+            yield f"{self.name}_sum", key, series[-2]
+            yield f"{self.name}_count", key, series[-1]
+
+class Registry:
+    """
+    Holds the metrics of one process. Thread-safe: every update goes
+    through the registry lock, which is cheap next to an HTTP call.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help_text, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def inc(self, name, amount=1, help_text="", **labels):
+        metric = self.counter(name, help_text)
+        with self._lock:
+            metric.inc(amount, **labels)
+
+    def set(self, name, value, help_text="", **labels):
+        metric = self.gauge(name, help_text)
+        with self._lock:
+            metric.set(value, **labels)
+
+    def observe(self, name, value, help_text="", **labels):
+        metric = self.histogram(name, help_text)
+        with self._lock:
+            metric.observe(value, **labels)
+
+    def render(self):
+        """The registry in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                if metric.help:
+                    lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for name, key, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def to_dict(self):
+        """JSON-friendly dump, reloadable with Registry.from_dict()."""
+        with self._lock:
+            return {
+                name: {
+                    'kind': metric.kind,
+                    'help': metric.help,
+                    'buckets': list(getattr(metric, 'buckets', [])),
+                    'values': [[list(map(list, key)), value] for key, value in metric.values.items()]
+                }
+                for name, metric in self._metrics.items()
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        registry = cls()
+        registry.load_dict(data)
+        return registry
+
+    def load_dict(self, data, **labels):
+        """Adds the series of a to_dict() dump, with `labels` added to each."""
+        kinds = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+        for name, spec in data.items():
+            kwargs = {'buckets': spec['buckets']} if spec['kind'] == 'histogram' else {}
+            metric = self._get(kinds[spec['kind']], name, spec['help'], **kwargs)
+            for key, value in spec['values']:
+                metric.values[_labels_key(dict(map(tuple, key), **labels))] = value
+
+# The process-wide registry used by the worker and the web app
+REGISTRY = Registry()
+
+@contextmanager
+def span(name, registry=REGISTRY):
+    """Times the block and records it in forex_span_seconds{span=name}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(
+            'forex_span_seconds', time.perf_counter() - started,
+            help_text="Time spent in each step of a sync run.", span=name
+        )
+
+def shard_summary_path(path, worker):
+    """Where one worker writes its run summary: 'sync_summary.json' -> 'sync_summary.<worker>.json'."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^A-Za-z0-9_-]', '-', worker)}{ext}"
+
+def load_summaries(path):
+    """{file: summary} for every readable run summary written for `path` (one per worker)."""
+    root, ext = os.path.splitext(path)
+    summaries = {}
+    # The plain path is where workers wrote before summaries were sharded
+    for file in [path] + glob.glob(f"{glob.escape(root)}.*{ext}"):
+        try:
+            with open(file) as f:
+                summaries[file] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return summaries
+
+def render_summary_file(path):
+    """
+    Prometheus text for the metrics saved by the latest sync run (or '' if
+    there is none). A sharded run has one summary per worker; their series
+    are merged, each labelled with its worker.
+    """
+    summaries = list(load_summaries(path).values())
+    if not summaries:
+        return ""
+    latest = max(summaries, key=lambda summary: summary.get('finished_at', ''))
+    run_id = latest.get('run_id')
+    registry = Registry()
+    for summary in summaries if run_id else [latest]:
+        if summary.get('run_id') == run_id:
+            labels = {'worker': summary['worker']} if summary.get('worker') else {}
+            registry.load_dict(summary.get('metrics', {}), **labels)
+    return registry.render()
@@ -0,0 +1,158 @@
+import os
+import time
+import random
+import threading
+import dotenv
+
+# Load environment variables
+dotenv.load_dotenv()
+
+# --- CONFIGURATION ---
+# Sustained Calendar API calls per second, across all users / for one user.
+# Google's default quota is 600 calls per minute per user.
+CALENDAR_GLOBAL_QPS = float(os.environ.get('CALENDAR_GLOBAL_QPS', '50'))
+CALENDAR_USER_QPS = float(os.environ.get('CALENDAR_USER_QPS', '10'))
+
+# Retries of a throttled/5xx call, and the backoff between them (seconds)
+CALENDAR_MAX_RETRIES = int(os.environ.get('CALENDAR_MAX_RETRIES', '5'))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+
+# The rate never drops below this fraction of its configured value
+MIN_RATE_FRACTION = 0.05
+
+# Idle per-user buckets are dropped after this many seconds
+USER_BUCKET_IDLE = 300
+
+RETRYABLE_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'backendError', 'quotaExceeded'}
+
+class TokenBucket:
+    """
+    A token bucket whose refill rate adapts to the server: halved on every
+    throttle, then raised back a little on every success (AIMD).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n=1):
+        """
+        Takes `n` tokens and returns how long the caller must wait before
+        using them. A request larger than the bucket runs it into debt, so
+        a 50-call batch is still allowed but delays whoever comes next.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= n
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * MIN_RATE_FRACTION)
+
+class RateLimiter:
+    """One global bucket plus one bucket per user, shared by all worker threads."""
+
+    def __init__(self, global_rate=None, user_rate=None):
+        self.global_bucket = TokenBucket(global_rate or CALENDAR_GLOBAL_QPS)
+        self.user_rate = user_rate or CALENDAR_USER_QPS
+        self.user_buckets = {}
+        self.lock = threading.Lock()
+
+    def _user_bucket(self, user):
+        with self.lock:
+            bucket = self.user_buckets.get(user)
+            if bucket is None:
+                self._prune()
+                bucket = self.user_buckets[user] = TokenBucket(self.user_rate)
+            return bucket
+
+    def _prune(self):
+        cutoff = time.monotonic() - USER_BUCKET_IDLE
+        for user in [u for u, b in self.user_buckets.items() if b.updated < cutoff]:
+            del self.user_buckets[user]
+
+    def acquire(self, user, n=1):
+        """Blocks until `n` calls for `user` fit both budgets. Returns the seconds waited."""
+        wait = max(self.global_bucket.reserve(n), self._user_bucket(user).reserve(n))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self, user):
+        self.global_bucket.throttled()
+        self._user_bucket(user).throttled()
+
+    def succeeded(self, user):
+        self.global_bucket.succeeded()
+        self._user_bucket(user).succeeded()
+
+# The process-wide limiter used by the sync worker
+LIMITER = RateLimiter()
+
+def _status(exception):
+    return getattr(getattr(exception, 'resp', None), 'status', None)
+
+def _reasons(exception):
+    details = getattr(exception, 'error_details', None) or []
+    if not isinstance(details, list):
+        return set()
+    return {d.get('reason') for d in details if isinstance(d, dict)}
+
+def is_retryable(exception):
+    """True for 429s, 5xx and 403s caused by a rate or quota limit."""
+    status = str(_status(exception) or '')
+    if status == '429' or status.startswith('5'):
+        return True
+    reasons = _reasons(exception)
+    return status == '403' and (bool(reasons & RETRYABLE_REASONS) or 'rate limit' in str(exception).lower())
+
+def is_throttle(exception):
+    """True if the server asked us to slow down (as opposed to a plain 5xx)."""
+    return is_retryable(exception) and not str(_status(exception) or '').startswith('5')
+
+def retry_after(exception):
+    """Seconds from the Retry-After header of a failed response, or None."""
+    resp = getattr(exception, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after_seconds=None):
+    """Exponential backoff with full jitter, never shorter than Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after_seconds is not None:
+        delay = max(delay, retry_after_seconds)
+    return delay
+
+def execute_with_retry(http_request, user, limiter=LIMITER, max_retries=None):
+    """Executes a single googleapiclient request through the limiter, retrying throttles."""
+    max_retries = CALENDAR_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        limiter.acquire(user)
+        try:
+            response = http_request.execute()
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_retries:
+                raise
+            if is_throttle(e):
+                limiter.throttled(user)
+            time.sleep(backoff_delay(attempt, retry_after(e)))
+            continue
+        limiter.succeeded(user)
+        return response
@@ -0,0 +1,182 @@
+import os
+import time
+import heapq
+import datetime
+import logging
+import dotenv
+from zoneinfo import ZoneInfo
+
+from event_cache import get_events
+from sync_worker import (
+    archive_events,
+    build_event_record,
+    event_day,
+    event_ids,
+    get_db_connection,
+    parse_event_time,
+    run_user_jobs,
+    SERVER_TIMEZONE
+)
+
+# Load environment variables
+dotenv.load_dotenv()
+
+# --- CONFIGURATION ---
+# Polling window around each release, in seconds
+RELEASE_WINDOW_BEFORE = int(os.environ.get('RELEASE_WINDOW_BEFORE', '30'))
+RELEASE_WINDOW_AFTER = int(os.environ.get('RELEASE_WINDOW_AFTER', '600'))
+# Seconds between scrapes while waiting for an 'actual' value
+RELEASE_POLL_INTERVAL = int(os.environ.get('RELEASE_POLL_INTERVAL', '15'))
+# Re-read the calendar at least this often, to pick up reschedules
+IDLE_RECHECK = 1800
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Scraped times are wall-clock times in SERVER_TIMEZONE, which need not be
+# the host's zone (e.g. a UTC server), so every datetime here is aware.
+TZ = ZoneInfo(SERVER_TIMEZONE)
+
+def _now():
+    return datetime.datetime.now(TZ)
+
+def release_time(event):
+    """The (timezone-aware) release datetime of an event, or None for all-day/tentative ones."""
+    start_iso, _, is_all_day = parse_event_time(event['time'], event_day(event))
+    if is_all_day:
+        return None
+    return datetime.datetime.fromisoformat(start_iso).replace(tzinfo=TZ)
+
+def build_release_queue(events, now):
+    """
+    Returns a heap of (release_datetime, [event_ids]) for events that have
+    no 'actual' value yet and whose polling window has not closed.
+    Events released at the same minute share one entry.
+
+    Events without a forecast (speeches, testimony, auctions) never get an
+    'actual' either, so they are not watched at all.
+    """
+    by_time = {}
+    for event_id, event in zip(event_ids(events), events):
+        if event['actual'] or not event.get('forecast'):
+            continue
+        released_at = release_time(event)
+        if released_at is None:
+            continue
+        if released_at + datetime.timedelta(seconds=RELEASE_WINDOW_AFTER) < now:
+            continue
+        by_time.setdefault(released_at, []).append(event_id)
+
+    queue = [(released_at, ids) for released_at, ids in by_time.items()]
+    heapq.heapify(queue)
+    return queue
+
+def subscriber_jobs(records):
+    """
+    Finds the users subscribed to each record's (currency, impact) through
+    the indexed subscriptions table, skipping users who get the ICS feed
+    instead. Returns [(user, records_for_user)].
+    """
+    users = {}
+    wanted = {}
+    conn = get_db_connection()
+    for pair in {(record.currency, record.impact) for record in records}:
+        rows = conn.execute('''
+            SELECT u.* FROM subscriptions s
+            JOIN users u ON u.email = s.email
+            WHERE s.currency = ? AND s.impact = ? AND COALESCE(u.delivery, 'api') != 'feed'
+        ''', pair).fetchall()
+        for user in rows:
+            users[user['email']] = user
+            wanted.setdefault(user['email'], set()).add(pair)
+    conn.close()
+
+    return [
+        (user, [record for record in records if (record.currency, record.impact) in wanted[email]])
+        for email, user in users.items()
+    ]
+
+def push_released(records):
+    """Pushes freshly released EventRecords to their subscribers only."""
+    jobs = subscriber_jobs(records)
+    logger.info(f"Pushing {len(records)} released events to {len(jobs)} subscribers.")
+    return run_user_jobs(jobs)
+
+def _sleep_until(moment):
+    # Sleep in short slices so Ctrl+C and clock changes are handled promptly
+    while True:
+        remaining = (moment - _now()).total_seconds()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, 60))
+
+def open_event_ids(queue, now):
+    """IDs of the queued events whose polling window is open at `now`."""
+    opens = datetime.timedelta(seconds=RELEASE_WINDOW_BEFORE)
+    return {event_id for released_at, event_ids in queue if released_at - opens <= now for event_id in event_ids}
+
+def poll_releases(watching, day):
+    """
+    Forces one scrape of `day` and pushes every watched event whose 'actual'
+    has appeared. The scrape returns the whole day, so releases a few
+    minutes apart are all served by the same poll. Returns the pushed IDs.
+    """
+    # max_age=0 forces a scrape and refreshes the cached snapshot
+    events = get_events(day, max_age=0)
+    # IDs are numbered across the whole day, so they are taken before filtering
+    released = [
+        (event_id, event) for event_id, event in zip(event_ids(events), events)
+        if event['actual'] and event_id in watching
+    ]
+    if released:
+        # Unchanged rows are skipped, so archiving the whole day is cheap
+        archive_events(events)
+        push_released([build_event_record(event, event_id) for event_id, event in released])
+    return {event_id for event_id, _ in released}
+
+def run_scheduler():
+    """
+    Long-running mode: waits for the next release time on today's calendar,
+    then polls every RELEASE_POLL_INTERVAL seconds while any release window
+    is open, pushing 'actual' values as soon as they appear. An event that
+    never gets a value simply drops out when its window closes.
+    A pass that fails is logged and retried after RELEASE_POLL_INTERVAL.
+    Runs until interrupted.
+    """
+    logger.info("--- Starting Release Scheduler ---")
+    try:
+        while True:
+            try:
+                now = _now()
+                queue = build_release_queue(get_events(now.date()), now)
+
+                next_check = now + datetime.timedelta(seconds=IDLE_RECHECK)
+                if not queue:
+                    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), TZ)
+                    logger.info("No pending releases. Waiting...")
+                    _sleep_until(min(next_check, tomorrow))
+                    continue
+
+                watching = open_event_ids(queue, now)
+                if not watching:
+                    # Wait for the next window, re-reading the calendar in between in case it moves
+                    released_at, _ = queue[0]
+                    _sleep_until(min(released_at - datetime.timedelta(seconds=RELEASE_WINDOW_BEFORE), next_check))
+                    continue
+
+                # The queue is rebuilt from the fresh snapshot on the next pass,
+                # so pushed events and closed windows drop out by themselves
+                pushed = poll_releases(watching, now.date())
+                if len(pushed) < len(watching):
+                    time.sleep(RELEASE_POLL_INTERVAL)
+            except Exception as e:
+                # One failed pass (e.g. the DB is locked by a running sync)
+                # must not end a scheduler that is meant to run for days
+                logger.error(f"Scheduler pass failed: {e}")
+                time.sleep(RELEASE_POLL_INTERVAL)
+
+    except KeyboardInterrupt:
+        logger.info("--- Release Scheduler Stopped ---")
+
+if __name__ == "__main__":
+    run_scheduler()
@@ -1,16 +1,32 @@
 import os
 import dotenv
-import sqlite3
 import datetime
 import logging
 import re
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import sys
+import time
+import json
+import uuid
+import socket
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 
 # --- IMPORTS ---
-# Make sure your scraper file is named 'get_data.py' or update this import!
-from get_data import get_forex_events
+# Events come from the snapshot cache, which only scrapes when it is stale
+from event_cache import get_events, get_week, server_today
+import database
+from calendar_client import get_credentials, calendar_service, token_cache_enabled, token_columns
+from metrics import REGISTRY, load_summaries, shard_summary_path, span
+from rate_limit import (
+    LIMITER,
+    CALENDAR_MAX_RETRIES,
+    backoff_delay,
+    execute_with_retry,
+    is_retryable,
+    is_throttle,
+    retry_after
+)
 
 # Load environment variables
 dotenv.load_dotenv()
@@ -24,14 +40,52 @@ CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 # Default to Johannesburg since you are testing on your laptop
 SERVER_TIMEZONE = os.environ.get('SCRAPER_TIMEZONE', 'Africa/Johannesburg')
 
+# Number of users synced in parallel (1 = the old serial behaviour)
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', '8'))
+
+# Max sub-requests per Calendar batch call (Google recommends <= 50)
+BATCH_SIZE = 50
+
+# How long pushed-event hashes are kept in event_ledger
+LEDGER_RETENTION_DAYS = int(os.environ.get('LEDGER_RETENTION_DAYS', '14'))
+
+# Sharded runs: users claimed per batch, and how long a claim is held
+SYNC_CLAIM_BATCH = int(os.environ.get('SYNC_CLAIM_BATCH', '200'))
+SYNC_LEASE_SECONDS = int(os.environ.get('SYNC_LEASE_SECONDS', '600'))
+
+# Full calendar check (not just incremental changes) at least this often, in seconds.
+# It lists the user's whole calendar, so keep it well above the sync period.
+RECONCILE_INTERVAL = int(os.environ.get('RECONCILE_INTERVAL', str(7 * 24 * 3600)))
+
+# Also refresh the cached week ahead on each run, for the ICS feed ('0' turns it off)
+PREFETCH_WEEK = os.environ.get('PREFETCH_WEEK', '1') != '0'
+
+# Private extended property that marks the events this app created
+OWNER_KEY = 'forexCalendar'
+
+# Per-event outcomes counted in sync_user() results
+EVENT_OUTCOMES = ('created', 'updated', 'deleted', 'failed', 'unchanged')
+
+# Identifies this process in users.claimed_by
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# JSON summary of the last run, read by the /metrics route ('' disables it).
+# Each worker writes its own file next to it, see metrics.shard_summary_path()
+SYNC_SUMMARY_FILE = os.environ.get('SYNC_SUMMARY_FILE', 'sync_summary.json')
+
 # Configure Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled connection; conn.close() returns it to the pool
+    return database.get_db_connection(DB_FILE)
+
+def event_day(event_data):
+    """The calendar day of a scraped event (older snapshots have no 'date')."""
+    if event_data.get('date'):
+        return datetime.date.fromisoformat(event_data['date'])
+    return datetime.date.today()
 
 def generate_event_id(event_data):
     """
@@ -44,18 +98,38 @@ def generate_event_id(event_data):
     clean_id = re.sub(r'[^a-v0-9]', '', raw_id)
     
     # 2. Add Date to ensure uniqueness
-    today_str = datetime.date.today().strftime("%Y%m%d")
+    today_str = event_day(event_data).strftime("%Y%m%d")
     
     # 3. Combine
     unique_id = f"{today_str}{clean_id}"
     return unique_id[:100]
 
-def parse_event_time(time_str):
+def event_ids(events):
+    """
+    generate_event_id() for each of `events`, made unique within the list.
+    The same title can come up twice on one day (e.g. two speeches by the
+    same person): the first keeps the plain ID, later ones get a counter
+    (still only 0-9 and a-v), so each gets its own calendar event.
+    """
+    ids = []
+    taken = set()
+    for event in events:
+        base = generate_event_id(event)
+        event_id, occurrence = base, 1
+        while event_id in taken:
+            occurrence += 1
+            suffix = str(occurrence)
+            event_id = base[:100 - len(suffix)] + suffix
+        taken.add(event_id)
+        ids.append(event_id)
+    return ids
+
+def parse_event_time(time_str, day=None):
     """
-    Converts text like "8:30am" into ISO timestamps.
+    Converts text like "8:30am" on `day` (default: today) into ISO timestamps.
     Returns: (start_iso, end_iso, is_all_day_bool)
     """
-    today = datetime.date.today()
+    today = day or datetime.date.today()
     
     # 1. Handle "All Day" or "Tentative"
     if not time_str or "day" in time_str.lower() or "tentative" in time_str.lower():
@@ -76,111 +150,896 @@ def parse_event_time(time_str):
         logger.warning(f"Could not parse time: '{time_str}'. Defaulting to All Day.")
         return today.isoformat(), today.isoformat(), True
 
-def sync_calendars():
+class _ReadOnlyDict(dict):
+    """
+    A dict that refuses changes. Still a real dict, so the Calendar client
+    serialises it like any other request body.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("EventRecord bodies are shared and read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+def _read_only(value):
+    if isinstance(value, dict):
+        return _ReadOnlyDict((key, _read_only(item)) for key, item in value.items())
+    return value
+
+@dataclass(frozen=True, slots=True, eq=False)
+class EventRecord:
+    """
+    One scraped event, fully prepared for the Calendar API.
+
+    Built once per scrape by build_event_records() and shared by every user
+    who subscribes to it, so `body` (the request body for insert/update) is
+    read-only all the way down; `content_hash` is its fingerprint. Records
+    compare (and hash) by identity.
+    """
+    event_id: str
+    currency: str
+    impact: str
+    body: dict
+    content_hash: str
+
+def build_event_record(item, event_id=None):
+    """
+    Turns one scraped event dict into an EventRecord. Pass the event's
+    entry from event_ids() when it was scraped along with others.
+    """
+    start_iso, end_iso, is_all_day = parse_event_time(item['time'], event_day(item))
+
+    event_summary = f"{item['currency']} - {item['event']}"
+    event_desc = (
+        f"Impact: {item['impact']}\n"
+        f"Forecast: {item['forecast']}\n"
+        f"Actual: {item['actual']}\n"
+        f"Time: {item['time']}"
+    )
+
+    event_body = {
+        'id': event_id or generate_event_id(item),
+        'summary': event_summary,
+        'description': event_desc,
+        'transparency': 'transparent', # Doesn't block 'Busy' status
+        'colorId': '11' if item['impact'] == 'High' else '6',
+        'extendedProperties': {'private': {OWNER_KEY: '1'}}  # Lets reconciliation tell our events apart
+    }
+
+    # Use the SERVER_TIMEZONE from .env
+    if is_all_day:
+        event_body['start'] = {'date': start_iso}
+        event_body['end'] = {'date': end_iso}
+    else:
+        event_body['start'] = {
+            'dateTime': start_iso,
+            'timeZone': SERVER_TIMEZONE
+        }
+        event_body['end'] = {
+            'dateTime': end_iso,
+            'timeZone': SERVER_TIMEZONE
+        }
+
+    return EventRecord(
+        event_id=event_body['id'],
+        currency=sys.intern(item['currency']),
+        impact=sys.intern(item['impact']),
+        body=_read_only(event_body),
+        content_hash=content_hash(event_body)
+    )
+
+def build_event_records(all_events):
+    """Prepares every scraped event once per run (see EventRecord)."""
+    return [build_event_record(item, event_id) for item, event_id in zip(all_events, event_ids(all_events))]
+
+def save_access_token(email, creds):
+    """Stores the (encrypted) access token so the next run can skip the refresh."""
+    access_token, token_expiry = token_columns(creds)
+    if not access_token:
+        return
+    conn = get_db_connection()
+    conn.execute(
+        "UPDATE users SET access_token = ?, token_expiry = ? WHERE email = ?",
+        (access_token, token_expiry, email)
+    )
+    conn.commit()
+    conn.close()
+
+def content_hash(event_body):
+    """Stable SHA-256 of an event body, used to detect changes between runs."""
+    payload = json.dumps(event_body, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _is_duplicate_error(exception):
+    """True if an insert failed because the event ID is already taken."""
+    status = getattr(getattr(exception, 'resp', None), 'status', None)
+    return str(status) == '409' or "already exists" in str(exception).lower()
+
+def _is_missing_error(exception):
+    """True if a call failed because the event ID does not exist (any more)."""
+    return str(getattr(getattr(exception, 'resp', None), 'status', None)) in ('404', '410')
+
+def _execute_batch(service, requests, method, user=None, responses=None):
+    """
+    Sends (request_id, http_request) pairs as Calendar batch requests.
+    `method` ('insert', 'update', ...) only labels the metrics. If a
+    `responses` dict is given, successful response bodies are stored in it.
+
+    Every chunk goes through the shared rate limiter (global + per-user
+    budget for `user`). Sub-requests that come back throttled or 5xx are
+    queued and resent after an exponential, jittered backoff that honours
+    Retry-After, up to CALENDAR_MAX_RETRIES times.
+    Returns {request_id: exception_or_None}.
+    """
+    outcomes = {}
+
+    def callback(request_id, response, exception):
+        outcomes[request_id] = exception
+        if responses is not None and exception is None:
+            responses[request_id] = response
+
+    pending = list(requests)
+    for attempt in range(CALENDAR_MAX_RETRIES + 1):
+        for i in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[i:i + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id, http_request in chunk:
+                batch.add(http_request, request_id=request_id)
+            LIMITER.acquire(user, len(chunk))
+            try:
+                with span(f'calendar_batch_{method}'):
+                    batch.execute()
+            except Exception as e:
+                # The batch call itself failed: every sub-request shares its fate
+                if not is_retryable(e):
+                    raise
+                outcomes.update((request_id, e) for request_id, _ in chunk)
+            REGISTRY.inc('forex_sync_http_requests_total', help_text="HTTP requests sent to the Calendar API.", kind='batch')
+            REGISTRY.inc('forex_sync_api_calls_total', len(chunk), help_text="Calendar API calls, counting each batch sub-request.", method=method)
+
+        # Retry queue: only the calls the server asked us to repeat
+        retry = [(request_id, http_request) for request_id, http_request in pending if is_retryable(outcomes[request_id])]
+        errors = [outcomes[request_id] for request_id, _ in retry]
+        if any(is_throttle(e) for e in errors):
+            LIMITER.throttled(user)
+        else:
+            LIMITER.succeeded(user)
+        if not retry or attempt == CALENDAR_MAX_RETRIES:
+            break
+
+        waits = [seconds for seconds in map(retry_after, errors) if seconds is not None]
+        delay = backoff_delay(attempt, max(waits) if waits else None)
+
+        REGISTRY.inc('forex_sync_retries_total', len(retry), help_text="Calendar API calls retried after a throttle or 5xx.", method=method)
+        logger.info(f"  Retrying {len(retry)} {method} calls in {delay:.1f}s (attempt {attempt + 1}).")
+        time.sleep(delay)
+        pending = retry
+
+    return outcomes
+
+def write_events(service, event_bodies, user=None, remote_updated=None, known_ids=()):
+    """
+    Upserts a user's events with as few HTTP round trips as possible.
+
+    Events in `known_ids` (in the ledger, so already in the calendar) go
+    straight to one update batch; any that turn out to be gone are inserted
+    instead. The rest go out in one insert batch, and any that collide with
+    an existing event ID are retried as updates in a second batch. Throttled
+    calls are retried by _execute_batch(); events that still fail are left
+    out of the ledger, so the next run picks them up again.
+    If a `remote_updated` dict is given, it receives the server's 'updated'
+    timestamp of every event written.
+    Returns {event_id: 'created' | 'updated' | 'failed'}.
+    """
+    bodies = {body['id']: body for body in event_bodies}
+    results = {}
+    responses = {}
+
+    def update(ev_ids):
+        # Returns the IDs that no longer exist, so they can be inserted
+        requests = [
+            (ev_id, service.events().update(calendarId='primary', eventId=ev_id, body=bodies[ev_id]))
+            for ev_id in ev_ids
+        ]
+        missing = []
+        for ev_id, exception in _execute_batch(service, requests, 'update', user, responses).items():
+            if exception is None:
+                results[ev_id] = 'updated'
+                logger.debug(f"  Updated: {bodies[ev_id]['summary']}")
+            elif _is_missing_error(exception):
+                missing.append(ev_id)
+            else:
+                results[ev_id] = 'failed'
+                logger.warning(f"  Failed to update event {bodies[ev_id]['summary']}: {exception}")
+        return missing
+
+    # 1. Update the events we know we pushed before
+    to_insert = update([ev_id for ev_id in bodies if ev_id in known_ids])
+    to_insert += [ev_id for ev_id in bodies if ev_id not in known_ids]
+
+    # 2. Insert the rest (create new)
+    inserts = [
+        (ev_id, service.events().insert(calendarId='primary', body=bodies[ev_id]))
+        for ev_id in to_insert
+    ]
+    to_update = []
+    for ev_id, exception in _execute_batch(service, inserts, 'insert', user, responses).items():
+        if exception is None:
+            results[ev_id] = 'created'
+            logger.debug(f"  Created: {bodies[ev_id]['summary']}")
+        elif _is_duplicate_error(exception) and ev_id not in known_ids:
+            # If error is "already exists", we UPDATE it instead
+            to_update.append(ev_id)
+        else:
+            results[ev_id] = 'failed'
+            logger.warning(f"  Failed to add event {bodies[ev_id]['summary']}: {exception}")
+
+    # 3. Update the ones that already existed after all
+    for ev_id in update(to_update):
+        results[ev_id] = 'failed'
+        logger.warning(f"  Failed to update event {bodies[ev_id]['summary']}: it no longer exists")
+
+    if remote_updated is not None:
+        remote_updated.update(
+            (ev_id, (responses.get(ev_id) or {}).get('updated')) for ev_id, status in results.items() if status != 'failed'
+        )
+    return results
+
+def delete_events(service, event_ids, user=None):
+    """
+    Deletes events in batches. Returns the IDs that are gone afterwards
+    (an event that was already deleted counts as gone).
+    """
+    requests = [(ev_id, service.events().delete(calendarId='primary', eventId=ev_id)) for ev_id in event_ids]
+    deleted = []
+    for ev_id, exception in _execute_batch(service, requests, 'delete', user).items():
+        if exception is None or _is_missing_error(exception):
+            deleted.append(ev_id)
+        else:
+            logger.warning(f"  Failed to delete event {ev_id}: {exception}")
+    return deleted
+
+# --- RECONCILIATION ---
+def list_changes(service, sync_token=None, user=None):
+    """
+    Pages through events.list. With a sync token only events changed since
+    that token come back (deleted ones included); without one, every event.
+    Returns (events, next_sync_token). An expired token raises an HttpError 410.
+    """
+    events = []
+    page_token = None
+    while True:
+        params = {'calendarId': 'primary', 'showDeleted': True, 'maxResults': 2500}
+        if sync_token:
+            params['syncToken'] = sync_token
+        if page_token:
+            params['pageToken'] = page_token
+
+        with span('calendar_list'):
+            response = execute_with_retry(service.events().list(**params), user)
+        REGISTRY.inc('forex_sync_http_requests_total', help_text="HTTP requests sent to the Calendar API.", kind='single')
+        REGISTRY.inc('forex_sync_api_calls_total', help_text="Calendar API calls, counting each batch sub-request.", method='list')
+
+        events.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return events, response.get('nextSyncToken')
+
+def is_owned(event):
+    """True for events this app created (see OWNER_KEY)."""
+    return event.get('extendedProperties', {}).get('private', {}).get(OWNER_KEY) == '1'
+
+def _changed_since_push(event, remote_updated):
+    # remote_updated is the 'updated' value Google returned for our own
+    # write, so any other value means somebody else touched the event.
+    # Comparing server values with server values is immune to clock skew.
+    # Entries written before this was recorded are only checked for deletion.
+    return bool(remote_updated) and event.get('updated') != remote_updated
+
+def stale_ledger_ids(events, pushed, full):
+    """
+    Ledger entries the calendar no longer matches. After an incremental
+    list: events we own that were deleted or edited elsewhere since we
+    pushed them. After a full list: also events that are missing entirely.
+    `pushed` maps event_id -> the 'updated' value of our last write.
+    """
+    # Deletion tombstones are only guaranteed to carry 'id' and 'status',
+    # so they cannot be checked with is_owned(); the ledger proves they are ours
+    owned = {
+        event['id']: event for event in events
+        if event['id'] in pushed and (event.get('status') == 'cancelled' or is_owned(event))
+    }
+    stale = {
+        ev_id for ev_id, event in owned.items()
+        if event.get('status') == 'cancelled' or _changed_since_push(event, pushed[ev_id])
+    }
+    if full:
+        stale |= {ev_id for ev_id in pushed if ev_id not in owned}
+    return stale
+
+def reconcile_user(service, user, pushed):
+    """
+    Fetches the calendar changes since the user's stored nextSyncToken (or
+    everything, on the first run, when the token expired or a periodic full
+    check is due). Returns (stale_ledger_ids, next_sync_token, was_full).
+    """
+    email = user['email']
+    full_due = (user['reconciled_at'] or 0) < time.time() - RECONCILE_INTERVAL
+    sync_token = None if full_due else user['sync_token']
+
+    if sync_token:
+        try:
+            events, next_token = list_changes(service, sync_token, email)
+            return stale_ledger_ids(events, pushed, full=False), next_token, False
+        except Exception as e:
+            if str(getattr(getattr(e, 'resp', None), 'status', '')) != '410':
+                raise
+            logger.info(f"  Sync token expired for {email}. Running a full check.")
+
+    events, next_token = list_changes(service, None, email)
+    return stale_ledger_ids(events, pushed, full=True), next_token, True
+
+def index_events(records):
+    """Maps (currency, impact) -> positions in records."""
+    index = {}
+    for pos, record in enumerate(records):
+        index.setdefault((record.currency, record.impact), []).append(pos)
+    return index
+
+def filter_for_signature(signature, records, index):
+    """The events matching a preference signature, in scrape order."""
+    impacts, currencies = signature
+    positions = sorted(
+        pos
+        for currency in currencies
+        for impact in impacts
+        for pos in index.get((currency, impact), ())
+    )
+    return [records[pos] for pos in positions]
+
+def group_users(users):
+    """Buckets users by database.preference_signature(), keeping the DB order inside each bucket."""
+    groups = {}
+    for user in users:
+        groups.setdefault(database.preference_signature(user), []).append(user)
+    return groups
+
+def record_user_metrics(result):
+    """Adds one sync_user() result to the event counters and latency histogram."""
+    for outcome in EVENT_OUTCOMES:
+        if result[outcome]:
+            REGISTRY.inc('forex_sync_events_total', result[outcome],
+                         help_text="Events per outcome (unchanged = skipped via the ledger).", outcome=outcome)
+    REGISTRY.inc('forex_sync_users_total', help_text="Users processed, by status.", status=result['status'])
+    REGISTRY.observe('forex_sync_user_seconds', result['seconds'],
+                     help_text="Wall-clock time to sync one user.", status=result['status'])
+
+def write_run_summary(results, seconds, path=None, run_id=None):
+    """
+    Writes a JSON summary of this worker's share of a run (totals, per-step
+    timings and the full metrics registry) so the web app can serve it on
+    /metrics. Each worker has its own file, and the web app merges those of
+    the latest run; files left from earlier runs are removed.
+    """
+    path = SYNC_SUMMARY_FILE if path is None else path
+    if not path:
+        return
+
+    statuses = {}
+    for r in results:
+        statuses[r['status']] = statuses.get(r['status'], 0) + 1
+
+    summary = {
+        'run_id': run_id,
+        'worker': WORKER_ID,
+        'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'seconds': round(seconds, 3),
+        'users': len(results),
+        'statuses': statuses,
+        'events': {
+            outcome: sum(r[outcome] for r in results)
+            for outcome in EVENT_OUTCOMES
+        },
+        'metrics': REGISTRY.to_dict()
+    }
+
+    shard_path = shard_summary_path(path, WORKER_ID)
+    tmp_path = f"{shard_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, shard_path)  # Atomic, so /metrics never reads half a file
+
+    for other_path, other in load_summaries(path).items():
+        if other_path != shard_path and other.get('run_id') != run_id:
+            try:
+                os.remove(other_path)
+            except OSError:
+                pass  # Another worker removed it first
+
+def connect_calendar(user):
+    """
+    Returns (credentials, Calendar service) for a users row. The cached
+    access token is reused until it is about to expire; a refreshed one is
+    saved straight away.
+    """
+    with span('credentials'):
+        creds, refreshed = get_credentials(user, CLIENT_ID, CLIENT_SECRET)
+    if refreshed:
+        REGISTRY.inc('forex_sync_token_refreshes_total', help_text="OAuth access token refreshes.")
+        save_access_token(user['email'], creds)
+
+    # Each user gets their own service object on top of the thread's
+    # shared connection; the discovery document is parsed once per process.
+    with span('service_build'):
+        service = calendar_service(creds)
+    return creds, service
+
+def sync_user(user, records, days=None):
+    """
+    Pushes `records` (the EventRecords matching the user's preferences)
+    to a single user's Google Calendar.
+    Events whose body is identical to the last push (per event_ledger) are
+    not sent again.
+
+    `days` is the set of dates `records` fully covers (the daily run passes
+    the scraped day; release pushes pass nothing). For those days, events we
+    pushed earlier that are no longer in `records` (dropped or moved by
+    ForexFactory, or no longer wanted) are deleted, and the calendar is
+    reconciled against its nextSyncToken so edits made elsewhere are undone.
+    The incremental check rides along with runs that write or delete
+    anyway; a user with nothing new is only authenticated when their
+    periodic full check is due.
+
+    Returns a dict describing the outcome so callers can aggregate results.
+    Any exception is caught here so one bad user never stops the run.
+    """
+    email = user['email']
+    result = {'email': email, 'status': 'ok', **dict.fromkeys(EVENT_OUTCOMES, 0)}
+    started = time.perf_counter()
+
+    try:
+        logger.info(f"Syncing for: {email}")
+
+        # --- A. Diff Against the Ledger ---
+        # Only events that are new or changed since the last push are sent.
+        conn = get_db_connection()
+        ledger = conn.execute(
+            "SELECT event_id, content_hash, remote_updated FROM event_ledger WHERE email = ?", (email,)
+        ).fetchall()
+        conn.close()
+        hashes = {row['event_id']: row['content_hash'] for row in ledger}
+
+        changed = [record for record in records if hashes.get(record.event_id) != record.content_hash]
+        result['unchanged'] = len(records) - len(changed)
+
+        # IDs start with the event's YYYYMMDD, see generate_event_id()
+        day_keys = {day.strftime("%Y%m%d") for day in days or ()}
+        wanted = {record.event_id for record in records}
+        orphans = [ev_id for ev_id in hashes if ev_id[:8] in day_keys and ev_id not in wanted]
+
+        if not records and not orphans:
+            logger.info(f"  No matching events for {email}. Skipping.")
+            result['status'] = 'skipped'
+            return result
+
+        reconcile_due = bool(days) and (user['reconciled_at'] or 0) < time.time() - RECONCILE_INTERVAL
+        if not changed and not orphans and not reconcile_due:
+            logger.info(f"  All {len(records)} events unchanged for {email}. Skipping.")
+            result['status'] = 'skipped'
+            return result
+
+        # --- B/C. Authenticate and Connect to Calendar API ---
+        creds, service = connect_calendar(user)
+        cached_token = creds.token
+
+        # --- D. Reconcile With What Is Actually in the Calendar ---
+        # Events edited or deleted elsewhere lose their ledger entry, so the
+        # diff below sends them again.
+        next_sync_token, full_check = None, False
+        if days:
+            try:
+                with span('reconcile'):
+                    stale, next_sync_token, full_check = reconcile_user(service, user, {row['event_id']: row['remote_updated'] for row in ledger})
+            except Exception as e:
+                logger.warning(f"  Reconciliation failed for {email}: {e}")
+                stale = set()
+            if stale:
+                logger.info(f"  {len(stale)} events were changed outside the app. Restoring.")
+                for ev_id in stale:
+                    hashes.pop(ev_id, None)
+                changed = [record for record in records if hashes.get(record.event_id) != record.content_hash]
+                result['unchanged'] = len(records) - len(changed)
+
+        # --- E. Delete Orphans ---
+        deleted = delete_events(service, orphans, email) if orphans else []
+        result['deleted'] = len(deleted)
+        result['failed'] += len(orphans) - len(deleted)
+
+        # --- F. Add/Update Events in Batches ---
+        remote_updated = {}
+        outcomes = write_events(service, [record.body for record in changed], email, remote_updated, hashes) if changed else {}
+        for status in outcomes.values():
+            result[status] += 1
+
+        # --- G. Record What Was Pushed ---
+        pushed_hashes = {record.event_id: record.content_hash for record in changed}
+        written = [
+            (email, ev_id, pushed_hashes[ev_id], remote_updated.get(ev_id))
+            for ev_id, status in outcomes.items() if status != 'failed'
+        ]
+        stale_ids = {row['event_id'] for row in ledger} - set(hashes)
+        forgotten = [(email, ev_id) for ev_id in set(deleted) | stale_ids]
+        conn = get_db_connection()
+        if forgotten:
+            conn.executemany("DELETE FROM event_ledger WHERE email = ? AND event_id = ?", forgotten)
+        if written:
+            conn.executemany('''
+                INSERT INTO event_ledger (email, event_id, content_hash, remote_updated, pushed_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(email, event_id) DO UPDATE SET
+                    content_hash = excluded.content_hash,
+                    remote_updated = excluded.remote_updated,
+                    pushed_at = excluded.pushed_at
+            ''', written)
+        if next_sync_token:
+            conn.execute("UPDATE users SET sync_token = ? WHERE email = ?", (next_sync_token, email))
+        if full_check:
+            conn.execute("UPDATE users SET reconciled_at = ? WHERE email = ?", (time.time(), email))
+        conn.commit()
+        conn.close()
+
+        # --- H. Keep the Cache Current if the Token Was Refreshed on a 401 ---
+        if creds.token != cached_token:
+            save_access_token(email, creds)
+
+    except Exception as e:
+        logger.error(f"Failed to sync user {email}: {e}")
+        result['status'] = 'error'
+        result['error'] = str(e)
+
+    finally:
+        result['seconds'] = time.perf_counter() - started
+        record_user_metrics(result)
+
+    return result
+
+def clear_user(user):
+    """
+    Deletes every event we pushed to a user's calendar and forgets it in
+    event_ledger. Used when a user switches to the ICS feed, which would
+    otherwise show each event a second time.
+    Returns a dict shaped like sync_user()'s result; events that could not
+    be deleted stay in the ledger and make the result an error, so the
+    caller can retry.
+    """
+    email = user['email']
+    result = {'email': email, 'status': 'ok', **dict.fromkeys(EVENT_OUTCOMES, 0)}
+    started = time.perf_counter()
+
+    try:
+        conn = get_db_connection()
+        event_ids = [row['event_id'] for row in conn.execute("SELECT event_id FROM event_ledger WHERE email = ?", (email,))]
+        conn.close()
+        if not event_ids:
+            result['status'] = 'skipped'
+            return result
+
+        logger.info(f"Removing {len(event_ids)} pushed events for: {email}")
+        creds, service = connect_calendar(user)
+        cached_token = creds.token
+        deleted = delete_events(service, event_ids, email)
+        result['deleted'] = len(deleted)
+        result['failed'] = len(event_ids) - len(deleted)
+
+        conn = get_db_connection()
+        conn.executemany("DELETE FROM event_ledger WHERE email = ? AND event_id = ?", [(email, ev_id) for ev_id in deleted])
+        conn.commit()
+        conn.close()
+
+        if creds.token != cached_token:
+            save_access_token(email, creds)
+        if result['failed']:
+            result['status'] = 'error'
+            result['error'] = f"{result['failed']} events could not be deleted"
+
+    except Exception as e:
+        logger.error(f"Failed to clear calendar of {email}: {e}")
+        result['status'] = 'error'
+        result['error'] = str(e)
+
+    finally:
+        result['seconds'] = time.perf_counter() - started
+        record_user_metrics(result)
+
+    return result
+
+def run_user_jobs(jobs, max_workers=None, on_result=None, days=None):
+    """
+    Runs sync_user() for each (user, records) pair in `jobs` on a thread
+    pool of `max_workers` threads (defaults to SYNC_WORKERS; 1 = serial).
+    `days` is passed through to sync_user().
+    `on_result` is called on the calling thread as each user finishes.
+    Returns the per-user results.
+    """
+    if max_workers is None:
+        max_workers = SYNC_WORKERS
+    max_workers = max(1, int(max_workers))
+
+    results = []
+    if max_workers == 1:
+        for user, records in jobs:
+            results.append(sync_user(user, records, days))
+            if on_result:
+                on_result(results[-1])
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sync')
+    try:
+        futures = [executor.submit(sync_user, user, records, days) for user, records in jobs]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if on_result:
+                on_result(results[-1])
+    except KeyboardInterrupt:
+        # Clean shutdown: drop users that have not started yet and let the
+        # in-flight ones finish so no event is left half-written.
+        logger.warning("Interrupted. Cancelling pending users and waiting for active ones...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    return results
+
+# --- SHARDED RUNS ---
+def start_or_join_run(day, run_id=None):
+    """
+    Returns the run_id this worker should work on. Joins the latest
+    unfinished run for `day` (so a crashed run is resumed and several
+    workers share one run) or starts a new one. Pass run_id to force one.
+    """
+    conn = get_db_connection()
+    try:
+        # IMMEDIATE takes the write lock, so two workers can't both start a run
+        conn.execute("BEGIN IMMEDIATE")
+        if run_id:
+            conn.execute(
+                "INSERT OR IGNORE INTO sync_runs (run_id, day) VALUES (?, ?)", (run_id, day.isoformat())
+            )
+        else:
+            row = conn.execute('''
+                SELECT run_id FROM sync_runs WHERE day = ? AND status = 'running'
+                ORDER BY started_at DESC LIMIT 1
+            ''', (day.isoformat(),)).fetchone()
+
+            if row and remaining_users(conn, row['run_id']):
+                run_id = row['run_id']
+                logger.info(f"Joining unfinished sync run {run_id}.")
+            else:
+                if row:
+                    # Every user was done but nobody marked it: close it first
+                    mark_run_complete(conn, row['run_id'])
+                run_id = f"{day.isoformat()}-{uuid.uuid4().hex[:8]}"
+                conn.execute("INSERT INTO sync_runs (run_id, day) VALUES (?, ?)", (run_id, day.isoformat()))
+                logger.info(f"Started sync run {run_id}.")
+        conn.commit()
+    finally:
+        conn.close()
+    return run_id
+
+def remaining_users(conn, run_id):
+    return conn.execute('''
+        SELECT COUNT(*) FROM users
+        WHERE (last_run_id IS NULL OR last_run_id != ?) AND COALESCE(delivery, 'api') != 'feed'
+    ''', (run_id,)).fetchone()[0]
+
+def mark_run_complete(conn, run_id):
+    conn.execute(
+        "UPDATE sync_runs SET status = 'complete', finished_at = CURRENT_TIMESTAMP WHERE run_id = ? AND status = 'running'",
+        (run_id,)
+    )
+
+def claim_users(run_id, limit=None, lease_seconds=None):
+    """
+    Leases up to `limit` users that are not yet done in `run_id` and are not
+    held by a live lease. Expired leases (a crashed worker) are re-claimed.
+    Users on the ICS feed (delivery = 'feed') are never claimed.
+    """
+    limit = limit or SYNC_CLAIM_BATCH
+    lease_seconds = lease_seconds or SYNC_LEASE_SECONDS
+    now = time.time()
+
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        users = conn.execute('''
+            SELECT * FROM users
+            WHERE (last_run_id IS NULL OR last_run_id != ?)
+              AND (claimed_until IS NULL OR claimed_until < ?)
+              AND COALESCE(delivery, 'api') != 'feed'
+            ORDER BY email
+            LIMIT ?
+        ''', (run_id, now, limit)).fetchall()
+        conn.executemany(
+            "UPDATE users SET claimed_by = ?, claimed_until = ? WHERE email = ?",
+            [(WORKER_ID, now + lease_seconds, user['email']) for user in users]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return users
+
+def renew_leases(emails, lease_seconds=None):
+    """
+    Extends this worker's lease on `emails`, so a slow batch is not
+    re-claimed by another worker while its users are still being synced.
+    Returns how many leases were still held.
+    """
+    lease_seconds = lease_seconds or SYNC_LEASE_SECONDS
+    emails = list(emails)
+    conn = get_db_connection()
+    renewed = conn.execute(f'''
+        UPDATE users SET claimed_until = ?
+        WHERE claimed_by = ? AND email IN ({','.join('?' * len(emails))})
+    ''', [time.time() + lease_seconds, WORKER_ID] + emails).rowcount
+    conn.commit()
+    conn.close()
+    if renewed < len(emails):
+        logger.warning(f"Lost the lease on {len(emails) - renewed} users; another worker may sync them too.")
+    return renewed
+
+def checkpoint_user(run_id, result):
+    """Marks a user as processed in `run_id` and releases its lease."""
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE users SET last_run_id = ?, claimed_by = NULL, claimed_until = NULL
+        WHERE email = ? AND claimed_by = ?
+    ''', (run_id, result['email'], WORKER_ID))
+    conn.commit()
+    conn.close()
+
+def finish_run(run_id):
+    """Closes the run if no user is left. Returns True if it is complete."""
+    conn = get_db_connection()
+    done = remaining_users(conn, run_id) == 0
+    if done:
+        mark_run_complete(conn, run_id)
+        conn.commit()
+    conn.close()
+    return done
+
+def archive_events(events, seen_at=None):
+    """
+    Upserts scraped events into the permanent 'events' archive. Rows whose
+    data is unchanged are left alone, so re-archiving a cached snapshot
+    does not touch updated_at (or the /api/events ETag).
+    Pass whole scrapes: repeated titles are told apart by event_ids().
+    """
+    seen_at = seen_at or time.time()
+    conn = get_db_connection()
+    conn.executemany('''
+        INSERT INTO events (day, currency, event_id, title, impact, time, forecast, actual, first_seen, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(day, currency, event_id) DO UPDATE SET
+            title = excluded.title,
+            impact = excluded.impact,
+            time = excluded.time,
+            forecast = excluded.forecast,
+            actual = excluded.actual,
+            updated_at = excluded.updated_at
+        WHERE title IS NOT excluded.title
+           OR impact IS NOT excluded.impact
+           OR time IS NOT excluded.time
+           OR forecast IS NOT excluded.forecast
+           OR actual IS NOT excluded.actual
+    ''', [
+        (event_day(e).isoformat(), e['currency'], event_id, e['event'], e['impact'],
+         e['time'], e['forecast'], e['actual'], seen_at, seen_at)
+        for e, event_id in zip(events, event_ids(events))
+    ])
+    conn.commit()
+    conn.close()
+
+def sync_calendars(max_workers=None, run_id=None):
+    """
+    Scrapes today's news once and syncs it to every user in the database.
+
+    Users are processed by a thread pool of `max_workers` threads (defaults to
+    the SYNC_WORKERS env var). With max_workers=1 the run is fully serial.
+
+    Work is leased from the users table in batches of SYNC_CLAIM_BATCH, so
+    several worker processes (sharing the same DB file) can run at once and
+    a crashed run is resumed where it stopped. Returns the per-user results
+    of the users this process handled.
+    """
+    if max_workers is None:
+        max_workers = SYNC_WORKERS
+    max_workers = max(1, int(max_workers))
+
+    run_started = time.perf_counter()
     logger.info("--- Starting Sync Job ---")
     logger.info(f"Server Timezone Configured As: {SERVER_TIMEZONE}")
+    # Reports a disabled (or misconfigured) access-token cache before any user is synced
+    token_cache_enabled()
 
     # 1. Get the Fresh News
     logger.info("Fetching news from ForexFactory...")
-    all_events = get_forex_events()
-    
+    with span('scrape'):
+        all_events = get_events()
+        if PREFETCH_WEEK:
+            # Only stale days are scraped, with one week-page request per week
+            get_week()
+
     if not all_events:
         logger.info("No news found today. Exiting.")
-        return
+        return []
 
-    # 2. Get All Users
+    # 2. Join (or Start) a Run
+    database.init_db(DB_FILE)  # Make sure the ledger table exists on older databases
+    with span('archive'):
+        archive_events(all_events)
     conn = get_db_connection()
-    users = conn.execute("SELECT * FROM users").fetchall()
+
+    # Event IDs are date-prefixed, so old ledger rows can never match again
+    conn.execute(
+        "DELETE FROM event_ledger WHERE pushed_at < datetime('now', ?)",
+        (f"-{LEDGER_RETENTION_DAYS} days",)
+    )
+    conn.commit()
     conn.close()
-    
-    logger.info(f"Found {len(users)} users to update.")
 
-    # 3. Process Each User
-    for user in users:
-        try:
-            email = user['email']
-            logger.info(f"Syncing for: {email}")
-
-            # --- A. Filter News for this User ---
-            user_impacts = user['impact_pref'].split(',') 
-            user_currencies = user['currencies_pref'].split(',') 
-            
-            filtered_events = []
-            for event in all_events:
-                if event['impact'] in user_impacts and event['currency'] in user_currencies:
-                    filtered_events.append(event)
-            
-            if not filtered_events:
-                logger.info(f"  No matching events for {email}. Skipping.")
-                continue
-
-            # --- B. Authenticate with Google ---
-            creds = Credentials(
-                token=None, 
-                refresh_token=user['refresh_token'],
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=CLIENT_ID,
-                client_secret=CLIENT_SECRET,
-                scopes=['https://www.googleapis.com/auth/calendar.events']
-            )
-            creds.refresh(Request())
-
-            # --- C. Connect to Calendar API ---
-            service = build('calendar', 'v3', credentials=creds)
-
-            # --- D. Add/Update Events ---
-            for item in filtered_events:
-                
-                start_iso, end_iso, is_all_day = parse_event_time(item['time'])
-
-                event_summary = f"{item['currency']} - {item['event']}"
-                event_desc = (
-                    f"Impact: {item['impact']}\n"
-                    f"Forecast: {item['forecast']}\n"
-                    f"Actual: {item['actual']}\n"
-                    f"Time: {item['time']}"
-                )
-                
-                ev_id = generate_event_id(item)
-                
-                event_body = {
-                    'id': ev_id,
-                    'summary': event_summary,
-                    'description': event_desc,
-                    'transparency': 'transparent', # Doesn't block 'Busy' status
-                    'colorId': '11' if item['impact'] == 'High' else '6'
-                }
-
-                # Use the SERVER_TIMEZONE from .env
-                if is_all_day:
-                    event_body['start'] = {'date': start_iso}
-                    event_body['end'] = {'date': end_iso}
-                else:
-                    event_body['start'] = {
-                        'dateTime': start_iso, 
-                        'timeZone': SERVER_TIMEZONE 
-                    }
-                    event_body['end'] = {
-                        'dateTime': end_iso, 
-                        'timeZone': SERVER_TIMEZONE 
-                    }
-
-                try:
-                    # Try to insert (create new)
-                    service.events().insert(calendarId='primary', body=event_body).execute()
-                    logger.info(f"  Created: {event_summary} at {item['time']}")
-                except Exception as e:
-                    # If error is "already exists", we UPDATE it instead
-                    if "already exists" in str(e).lower():
-                        service.events().update(calendarId='primary', eventId=ev_id, body=event_body).execute()
-                        logger.info(f"  Updated: {event_summary}")
-                    else:
-                        logger.warning(f"  Failed to add event: {e}")
+    run_id = start_or_join_run(server_today(), run_id)
 
-        except Exception as e:
-            logger.error(f"Failed to sync user {user['email']}: {e}")
+    # 3. Prepare Each Event Once
+    records = build_event_records(all_events)
+    index = index_events(records)
+    days = {event_day(event) for event in all_events}  # Days this scrape covers in full
+    group_records = {}  # signature -> filtered records, reused across batches
+
+    # 4. Claim Users in Batches and Process Them
+    results = []
+    while True:
+        with span('db_load'):
+            users = claim_users(run_id)
+        if not users:
+            break
+
+        jobs = []
+        for signature, group in group_users(users).items():
+            if signature not in group_records:
+                group_records[signature] = filter_for_signature(signature, records, index)
+            jobs.extend((user, group_records[signature]) for user in group)
+
+        logger.info(f"Claimed {len(users)} users (workers: {max_workers}).")
+        pending = {user['email'] for user in users}
+        renewed_at = time.monotonic()
+
+        def on_result(result):
+            nonlocal renewed_at
+            checkpoint_user(run_id, result)
+            pending.discard(result['email'])
+            # Throttling or large full checks can stretch a batch past its lease
+            if pending and time.monotonic() - renewed_at > SYNC_LEASE_SECONDS / 3:
+                renew_leases(pending)
+                renewed_at = time.monotonic()
+
+        results.extend(run_user_jobs(jobs, max_workers, on_result=on_result, days=days))
+
+    if finish_run(run_id):
+        logger.info(f"Sync run {run_id} is complete.")
+    else:
+        logger.info(f"Sync run {run_id}: remaining users are leased by other workers.")
+
+    elapsed = time.perf_counter() - run_started
+    REGISTRY.inc('forex_sync_runs_total', help_text="Completed sync runs.")
+    REGISTRY.set('forex_sync_last_run_seconds', elapsed, help_text="Duration of the last sync run.")
+    REGISTRY.set('forex_sync_last_run_timestamp', time.time(), help_text="Unix time the last sync run finished.")
+    write_run_summary(results, elapsed, run_id=run_id)
 
-    logger.info("--- Sync Job Complete ---")
+    failed = sum(1 for r in results if r['status'] == 'error')
+    logger.info(f"--- Sync Job Complete ({len(results) - failed} ok, {failed} failed) ---")
+    return results
 
 if __name__ == "__main__":
-    sync_calendars()
\ No newline at end of file
+    sync_calendars()
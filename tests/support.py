@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+
+class TempDbTestCase(unittest.TestCase):
+    """
+    Gives each test a fresh database file in self.db_file, with the DB_FILE
+    of every module in `db_modules` pointed at it.
+    """
+    db_modules = ()
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_file = os.path.join(tmp.name, 'users.db')
+        database.init_db(self.db_file)
+        self.addCleanup(database.close_pool, self.db_file)
+        for module in self.db_modules:
+            self.patch(module, 'DB_FILE', self.db_file)
+
+    def patch(self, target, attribute, value=mock.DEFAULT, **kwargs):
+        """mock.patch.object() for the length of the test. Returns the patched value."""
+        patcher = mock.patch.object(target, attribute, value, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
@@ -0,0 +1,76 @@
+import os
+import sys
+import datetime
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import event_cache
+from support import TempDbTestCase
+from event_cache import get_events, get_week, load_snapshot, save_snapshots, week_days
+
+FRIDAY = datetime.date(2026, 10, 16)
+
+def event_on(day, title='Building Permits'):
+    return {'date': day.isoformat(), 'time': '8:30am', 'currency': 'USD', 'event': title,
+            'impact': 'High', 'forecast': '', 'actual': ''}
+
+def week_page(day, week):
+    """What a week-view scrape returns: one event per day of the Sunday-Saturday week."""
+    return [event_on(d, f"Event {d}") for d in week_days(day)]
+
+class EventCacheTestCase(TempDbTestCase):
+    """A fresh cache database, with fetch_events() replaced by week_page()."""
+    db_modules = (event_cache,)
+
+    def setUp(self):
+        super().setUp()
+        self.patch(event_cache, '_schema_ready', False)
+        self.fetch_events = self.patch(event_cache, 'fetch_events', side_effect=week_page)
+
+class GetWeekTest(EventCacheTestCase):
+
+    def test_covers_the_next_seven_days(self):
+        events_by_day = get_week(FRIDAY)
+        self.assertEqual(list(events_by_day), [FRIDAY + datetime.timedelta(days=i) for i in range(7)])
+        self.assertTrue(all(len(events) == 1 for events in events_by_day.values()))
+
+    def test_scrapes_both_weeks_once(self):
+        get_week(FRIDAY)
+        self.assertEqual(self.fetch_events.call_args_list, [
+            mock.call(datetime.date(2026, 10, 11), week=True), mock.call(datetime.date(2026, 10, 18), week=True)
+        ])
+
+        self.fetch_events.reset_mock()
+        get_week(FRIDAY)
+        self.fetch_events.assert_not_called()
+
+    def test_sunday_needs_one_scrape(self):
+        get_week(datetime.date(2026, 10, 18))
+        self.assertEqual(self.fetch_events.call_count, 1)
+
+class RefreshDayTest(EventCacheTestCase):
+
+    def test_requests_the_dated_page(self):
+        self.fetch_events.side_effect = lambda day: [event_on(day)]
+        self.assertEqual(get_events(FRIDAY, max_age=0), [event_on(FRIDAY)])
+        self.fetch_events.assert_called_once_with(FRIDAY)
+
+    def test_page_for_another_day_keeps_the_snapshot(self):
+        thursday = FRIDAY - datetime.timedelta(days=1)
+        save_snapshots({FRIDAY: [event_on(FRIDAY)]}, fetched_at=1000)
+        self.fetch_events.side_effect = lambda day: [event_on(thursday)]
+
+        self.assertEqual(get_events(FRIDAY, max_age=0), [event_on(FRIDAY)])
+        self.assertEqual(load_snapshot(FRIDAY), ([event_on(FRIDAY)], 1000))
+        self.assertEqual(load_snapshot(thursday)[0], [event_on(thursday)])
+
+    def test_quiet_page_is_stored_as_empty(self):
+        self.fetch_events.side_effect = lambda day: []
+        self.assertEqual(get_events(FRIDAY, max_age=0), [])
+        self.assertEqual(load_snapshot(FRIDAY)[0], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import datetime
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from get_data import ScrapeError, parse_calendar_html
+
+FIXTURE = os.path.join(ROOT, 'fixtures', 'calendar_today.html')
+
+# The anchor is a few days off on purpose: every date must come from the page
+ANCHOR = datetime.date(2026, 10, 12)
+
+EXPECTED = [
+    {'date': '2026-10-16', 'time': '2:00am', 'currency': 'GBP', 'event': 'Retail Sales m/m',
+     'impact': 'Medium', 'forecast': '0.1%', 'actual': '0.4%'},
+    {'date': '2026-10-16', 'time': '3:00am', 'currency': 'EUR', 'event': 'ECB President Lagarde Speaks',
+     'impact': 'High', 'forecast': '', 'actual': ''},
+    {'date': '2026-10-16', 'time': '5:00am', 'currency': 'EUR', 'event': 'Final CPI y/y',
+     'impact': 'High', 'forecast': '2.2%', 'actual': '2.2%'},
+    {'date': '2026-10-16', 'time': '8:30am', 'currency': 'USD', 'event': 'Building Permits',
+     'impact': 'High', 'forecast': '1.43M', 'actual': ''},
+    {'date': '2026-10-16', 'time': '8:30am', 'currency': 'USD', 'event': 'Core Retail Sales m/m',
+     'impact': 'High', 'forecast': '0.3%', 'actual': ''},
+    {'date': '2026-10-16', 'time': '9:00am', 'currency': 'EUR', 'event': 'ECB President Lagarde Speaks',
+     'impact': 'High', 'forecast': '', 'actual': ''},
+    {'date': '2026-10-16', 'time': '10:00am', 'currency': 'USD', 'event': 'Prelim UoM Consumer Sentiment',
+     'impact': 'Medium', 'forecast': '70.1', 'actual': ''},
+    {'date': '2026-10-16', 'time': 'Tentative', 'currency': 'JPY', 'event': 'BOJ Policy Rate',
+     'impact': 'High', 'forecast': '0.25%', 'actual': ''},
+]
+
+ROW = '''
+<tr class="calendar__row">
+  <td class="calendar__cell calendar__date">{date}</td>
+  <td class="calendar__cell calendar__time"><div>{time}</div></td>
+  <td class="calendar__cell calendar__currency"><span>USD</span></td>
+  <td class="calendar__cell calendar__impact"><span class="icon icon--ff-impact-red"></span></td>
+  <td class="calendar__cell calendar__event"><div><span class="calendar__event-title">{event}</span></div></td>
+  <td class="calendar__cell calendar__actual"></td>
+  <td class="calendar__cell calendar__forecast"></td>
+</tr>'''
+
+def page(*rows):
+    return f"<html><body><table>{''.join(rows)}</table></body></html>"
+
+class ParseCalendarHtmlTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(FIXTURE, encoding='utf-8') as f:
+            self.events = parse_calendar_html(f.read(), ANCHOR)
+
+    def test_fixture_events(self):
+        self.assertEqual(self.events, EXPECTED)
+
+    def test_low_impact_rows_are_dropped(self):
+        titles = {event['event'] for event in self.events}
+        self.assertNotIn('Bank Holiday', titles)
+        self.assertNotIn('Housing Starts', titles)
+
+    def test_impact_is_classified(self):
+        impacts = {event['event']: event['impact'] for event in self.events}
+        self.assertEqual(impacts['Final CPI y/y'], 'High')
+        self.assertEqual(impacts['Retail Sales m/m'], 'Medium')
+
+    def test_date_is_carried_forward(self):
+        # Only the first row of the fixture has a date cell
+        self.assertEqual({event['date'] for event in self.events}, {'2026-10-16'})
+
+        html = page(
+            ROW.format(date='Thu <span>Oct 15</span>', time='1:00am', event='First'),
+            ROW.format(date='', time='2:00am', event='Second'),
+            ROW.format(date='Fri <span>Oct 16</span>', time='3:00am', event='Third'),
+            ROW.format(date='', time='4:00am', event='Fourth'),
+        )
+        dates = [(event['event'], event['date']) for event in parse_calendar_html(html, ANCHOR)]
+        self.assertEqual(dates, [
+            ('First', '2026-10-15'), ('Second', '2026-10-15'), ('Third', '2026-10-16'), ('Fourth', '2026-10-16')
+        ])
+
+    def test_time_is_carried_forward(self):
+        # The fixture prints 8:30am only on the first row of that slot
+        times = {event['event']: event['time'] for event in self.events}
+        self.assertEqual(times['Core Retail Sales m/m'], '8:30am')
+
+        html = page(
+            ROW.format(date='Thu <span>Oct 15</span>', time='8:30am', event='Average Hourly Earnings m/m'),
+            ROW.format(date='', time='', event='Non-Farm Employment Change'),
+            ROW.format(date='Fri <span>Oct 16</span>', time='', event='Next Day'),
+        )
+        times = [(event['event'], event['time']) for event in parse_calendar_html(html, ANCHOR)]
+        self.assertEqual(times, [
+            ('Average Hourly Earnings m/m', '8:30am'), ('Non-Farm Employment Change', '8:30am'), ('Next Day', '')
+        ])
+
+    def test_rows_before_the_first_date_get_the_anchor(self):
+        events = parse_calendar_html(page(ROW.format(date='', time='1:00am', event='Early')), ANCHOR)
+        self.assertEqual(events[0]['date'], ANCHOR.isoformat())
+
+    def test_year_is_taken_from_the_anchor(self):
+        html = page(ROW.format(date='Fri <span>Jan 1</span>', time='1:00am', event='New Year'))
+        events = parse_calendar_html(html, datetime.date(2026, 12, 30))
+        self.assertEqual(events[0]['date'], '2027-01-01')
+
+    def test_page_without_rows_raises(self):
+        with self.assertRaises(ScrapeError):
+            parse_calendar_html("<html><body><p>Just a moment...</p></body></html>", ANCHOR)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import datetime
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from get_data import parse_calendar_html
+from ics_feed import render_ics
+from sync_worker import build_event_records
+
+FIXTURE = os.path.join(ROOT, 'fixtures', 'calendar_today.html')
+
+STAMP = datetime.datetime(2026, 10, 16, 6, 0, tzinfo=datetime.timezone.utc)
+
+class RenderIcsTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(FIXTURE, encoding='utf-8') as f:
+            self.records = build_event_records(parse_calendar_html(f.read(), datetime.date(2026, 10, 16)))
+        self.lines = render_ics(self.records, STAMP).split('\r\n')
+
+    def test_every_vevent_has_its_own_uid(self):
+        uids = [line for line in self.lines if line.startswith('UID:')]
+        self.assertEqual(len(uids), self.lines.count('BEGIN:VEVENT'))
+        self.assertEqual(len(uids), len(self.records))
+        self.assertEqual(len(set(uids)), len(uids))
+
+    def test_repeated_title_keeps_both_times(self):
+        starts = [
+            self.lines[i + 3] for i, line in enumerate(self.lines)
+            if line == 'BEGIN:VEVENT' and 'Lagarde' in self.lines[i + 5]
+        ]
+        self.assertEqual(len(starts), 2)
+        self.assertNotEqual(starts[0], starts[1])
+
+if __name__ == '__main__':
+    unittest.main()
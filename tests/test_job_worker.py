@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+import job_worker
+import sync_worker
+from job_worker import claim_jobs, finish_job, renew_job_leases
+from support import TempDbTestCase
+
+EMAIL = 'trader@example.com'
+
+class JobQueueTest(TempDbTestCase):
+    db_modules = (sync_worker,)
+
+
+    def setUp(self):
+        super().setUp()
+        self.patch(job_worker, 'WORKER_ID', 'w1')
+
+    def enqueue(self, delay=0):
+        conn = database.get_db_connection(self.db_file)
+        database.enqueue_job(conn, 'sync_user', EMAIL, delay)
+        conn.commit()
+        conn.close()
+
+    def jobs(self):
+        conn = database.get_db_connection(self.db_file)
+        rows = conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        conn.close()
+        return rows
+
+    def make_due(self):
+        conn = database.get_db_connection(self.db_file)
+        conn.execute("UPDATE jobs SET run_after = ? WHERE status = 'queued'", (time.time() - 1,))
+        conn.commit()
+        conn.close()
+
+    def test_repeated_saves_collapse_into_one_job(self):
+        self.enqueue()
+        self.enqueue(delay=60)
+        jobs = self.jobs()
+        self.assertEqual(len(jobs), 1)
+        self.assertGreater(jobs[0]['run_after'], time.time() + 30)
+        self.assertEqual(claim_jobs(), [])
+
+    def test_claim_leases_due_jobs(self):
+        self.enqueue()
+        claimed = claim_jobs()
+        self.assertEqual([job['email'] for job in claimed], [EMAIL])
+        job = self.jobs()[0]
+        self.assertEqual((job['status'], job['claimed_by'], job['attempts']), ('running', 'w1', 1))
+        # A live lease keeps other workers away
+        self.assertEqual(claim_jobs(), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        self.enqueue()
+        claim_jobs()
+        conn = database.get_db_connection(self.db_file)
+        conn.execute("UPDATE jobs SET claimed_until = ?", (time.time() - 1,))
+        conn.commit()
+        conn.close()
+        self.assertEqual(len(claim_jobs()), 1)
+        self.assertEqual(self.jobs()[0]['attempts'], 2)
+
+    def test_success_marks_the_job_done(self):
+        self.enqueue()
+        finish_job(claim_jobs()[0])
+        job = self.jobs()[0]
+        self.assertEqual(job['status'], 'done')
+        self.assertIsNotNone(job['finished_at'])
+
+    def test_failure_is_retried_with_backoff(self):
+        self.enqueue()
+        finish_job(claim_jobs()[0], 'boom')
+        job = self.jobs()[0]
+        self.assertEqual((job['status'], job['last_error'], job['claimed_by']), ('queued', 'boom', None))
+        self.assertAlmostEqual(job['run_after'], time.time() + 30, delta=5)
+
+        self.make_due()
+        finish_job(claim_jobs()[0], 'boom')
+        self.assertAlmostEqual(self.jobs()[0]['run_after'], time.time() + 60, delta=5)
+
+    def test_failure_gives_up_after_max_attempts(self):
+        self.enqueue()
+        with mock.patch.object(job_worker, 'JOB_MAX_ATTEMPTS', 2):
+            finish_job(claim_jobs()[0], 'boom')
+            self.make_due()
+            finish_job(claim_jobs()[0], 'still broken')
+        job = self.jobs()[0]
+        self.assertEqual((job['status'], job['attempts'], job['last_error']), ('failed', 2, 'still broken'))
+        self.assertEqual(claim_jobs(), [])
+
+    def test_failed_job_is_superseded_by_a_newer_one(self):
+        self.enqueue()
+        running = claim_jobs()[0]
+        self.enqueue()  # Settings saved again while the first sync runs
+        finish_job(running, 'boom')
+        old, new = self.jobs()
+        self.assertEqual((old['status'], old['last_error']), ('superseded', 'boom'))
+        self.assertEqual(new['status'], 'queued')
+
+    def take_over(self):
+        """Expires this worker's leases and lets worker 'w2' claim the jobs."""
+        conn = database.get_db_connection(self.db_file)
+        conn.execute("UPDATE jobs SET claimed_until = ?", (time.time() - 1,))
+        conn.commit()
+        conn.close()
+        with mock.patch.object(job_worker, 'WORKER_ID', 'w2'):
+            return claim_jobs()
+
+    def test_renew_extends_only_own_leases(self):
+        self.enqueue()
+        job = claim_jobs(lease_seconds=60)[0]
+        self.assertEqual(renew_job_leases([job['id']], lease_seconds=600), 1)
+        self.assertGreater(self.jobs()[0]['claimed_until'], time.time() + 300)
+
+        self.take_over()
+        self.assertEqual(renew_job_leases([job['id']]), 0)
+
+    def test_finish_after_a_lost_lease_does_nothing(self):
+        self.enqueue()
+        job = claim_jobs()[0]
+        self.take_over()
+        for error in (None, 'boom'):
+            self.assertFalse(finish_job(job, error))
+        row = self.jobs()[0]
+        self.assertEqual((row['status'], row['claimed_by'], row['last_error']), ('running', 'w2', None))
+
+if __name__ == '__main__':
+    unittest.main()
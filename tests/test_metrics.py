@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import Registry, render_summary_file, shard_summary_path
+
+def summary(run_id, worker, finished_at, users):
+    registry = Registry()
+    registry.inc('forex_sync_users_total', users, status='ok')
+    return {'run_id': run_id, 'worker': worker, 'finished_at': finished_at, 'metrics': registry.to_dict()}
+
+class RenderSummaryFileTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'sync_summary.json')
+
+    def write(self, data):
+        with open(shard_summary_path(self.path, data['worker']), 'w') as f:
+            json.dump(data, f)
+
+    def test_shard_path_is_a_safe_file_name(self):
+        self.assertEqual(os.path.basename(shard_summary_path(self.path, 'host-1:4242')), 'sync_summary.host-1-4242.json')
+
+    def test_shards_of_the_latest_run_are_merged(self):
+        self.write(summary('run-1', 'a:1', '2026-10-15T06:00:00', 7))
+        self.write(summary('run-2', 'a:2', '2026-10-16T06:00:00', 3))
+        self.write(summary('run-2', 'b:2', '2026-10-16T06:01:00', 4))
+
+        lines = set(render_summary_file(self.path).splitlines())
+        self.assertIn('forex_sync_users_total{status="ok",worker="a:2"} 3', lines)
+        self.assertIn('forex_sync_users_total{status="ok",worker="b:2"} 4', lines)
+        self.assertFalse(any('a:1' in line for line in lines))
+
+    def test_missing_summary_renders_nothing(self):
+        self.assertEqual(render_summary_file(self.path), "")
+
+if __name__ == '__main__':
+    unittest.main()
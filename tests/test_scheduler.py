@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import sqlite3
+import datetime
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import scheduler
+from scheduler import TZ, build_release_queue, open_event_ids, release_time
+from sync_worker import event_ids
+
+DAY = datetime.date(2026, 10, 16)
+
+def event(title, time_str, forecast='0.3%', actual=''):
+    return {'date': DAY.isoformat(), 'time': time_str, 'currency': 'USD', 'event': title,
+            'impact': 'High', 'forecast': forecast, 'actual': actual}
+
+def at(hour, minute=0):
+    """A moment on DAY, in SERVER_TIMEZONE."""
+    return datetime.datetime(2026, 10, 16, hour, minute, tzinfo=TZ)
+
+class ReleaseTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        # A host zone far from SERVER_TIMEZONE, so host-local times would be hours off
+        old_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/Los_Angeles'
+        time.tzset()
+        self.addCleanup(self.restore_tz, old_tz)
+
+    @staticmethod
+    def restore_tz(old_tz):
+        if old_tz is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = old_tz
+        time.tzset()
+
+    def test_release_time_is_in_server_timezone(self):
+        released_at = release_time(event('Core Retail Sales m/m', '8:30am'))
+        self.assertEqual(released_at, at(8, 30))
+        self.assertEqual(released_at.utcoffset(), at(8, 30).utcoffset())
+
+    def test_all_day_events_have_no_release_time(self):
+        self.assertIsNone(release_time(event('BOJ Policy Rate', 'Tentative')))
+        self.assertIsNone(release_time(event('Bank Holiday', 'All Day')))
+
+    def test_window_is_compared_across_zones(self):
+        # 06:35 UTC is 08:35 in Johannesburg: the 8:30am window is still open
+        now = at(8, 35).astimezone(datetime.timezone.utc)
+        queue = build_release_queue([event('Core Retail Sales m/m', '8:30am')], now)
+        self.assertEqual([released_at for released_at, _ in queue], [at(8, 30)])
+
+class ReleaseQueueTest(unittest.TestCase):
+
+    def test_skips_unwatchable_events(self):
+        events = [
+            event('Lagarde Speaks', '9:00am', forecast=''),      # No forecast, so never an actual
+            event('Retail Sales m/m', '2:00am'),                  # Window closed hours ago
+            event('Final CPI y/y', '8:00am', actual='2.2%'),      # Already released
+            event('BOJ Policy Rate', 'Tentative'),                # No release time
+            event('Building Permits', '8:30am'),
+        ]
+        queue = build_release_queue(events, at(8, 0))
+        self.assertEqual(queue, [(at(8, 30), [event_ids(events)[4]])])
+
+    def test_events_in_one_slot_share_an_entry(self):
+        events = [event('Building Permits', '8:30am'), event('Core Retail Sales m/m', '8:30am')]
+        self.assertEqual(build_release_queue(events, at(8, 0)), [(at(8, 30), event_ids(events))])
+
+    def test_overlapping_windows_are_all_open(self):
+        events = [event('Building Permits', '8:30am'), event('Prelim UoM Consumer Sentiment', '8:35am'),
+                  event('Crude Oil Inventories', '10:30am')]  # Not open yet
+        ids = event_ids(events)
+        queue = build_release_queue(events, at(8, 36))
+
+        # 8:30's window stays open for RELEASE_WINDOW_AFTER; 8:35's opened just now
+        self.assertEqual(open_event_ids(queue, at(8, 36)), {ids[0], ids[1]})
+        self.assertEqual(open_event_ids(queue, at(8, 0)), set())
+
+class RunSchedulerTest(unittest.TestCase):
+
+    def test_failed_pass_is_retried(self):
+        get_events = mock.Mock(side_effect=[sqlite3.OperationalError("database is locked"), KeyboardInterrupt])
+        with mock.patch.object(scheduler, 'get_events', get_events), \
+                mock.patch.object(scheduler.time, 'sleep') as sleep:
+            scheduler.run_scheduler()
+
+        self.assertEqual(get_events.call_count, 2)
+        sleep.assert_called_once_with(scheduler.RELEASE_POLL_INTERVAL)
+
+if __name__ == '__main__':
+    unittest.main()
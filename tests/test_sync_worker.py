@@ -0,0 +1,408 @@
+import os
+import re
+import sys
+import time
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+import sync_worker
+from support import TempDbTestCase
+from get_data import parse_calendar_html
+from rate_limit import RateLimiter
+from sync_worker import (
+    OWNER_KEY,
+    build_event_record,
+    build_event_records,
+    content_hash,
+    generate_event_id,
+    stale_ledger_ids
+)
+
+FIXTURE = os.path.join(ROOT, 'fixtures', 'calendar_today.html')
+
+PUSHED = {'a': '2026-10-16T06:00:00.000Z', 'b': '2026-10-16T06:00:00.000Z', 'c': '2026-10-16T06:00:00.000Z'}
+
+def owned(event_id, updated='2026-10-16T06:00:00.000Z', **fields):
+    return dict(id=event_id, status='confirmed', updated=updated,
+                extendedProperties={'private': {OWNER_KEY: '1'}}, **fields)
+
+class StaleLedgerIdsTest(unittest.TestCase):
+
+    def test_untouched_events_are_not_stale(self):
+        events = [owned('a'), owned('b'), owned('c')]
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=False), set())
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=True), set())
+
+    def test_edited_event_is_stale(self):
+        events = [owned('a', updated='2026-10-16T07:00:00.000Z')]
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=False), {'a'})
+
+    def test_bare_tombstone_is_stale(self):
+        # The API only guarantees 'id' (and 'status') on deleted events
+        events = [{'id': 'b', 'status': 'cancelled'}]
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=False), {'b'})
+
+    def test_events_outside_the_ledger_are_ignored(self):
+        events = [owned('z', updated='2026-10-16T07:00:00.000Z'), {'id': 'y', 'status': 'cancelled'}]
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=False), set())
+
+    def test_unowned_event_with_our_id_is_not_trusted(self):
+        events = [{'id': 'a', 'status': 'confirmed', 'updated': '2026-10-16T07:00:00.000Z'}]
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=False), set())
+
+    def test_ledger_entries_without_a_write_timestamp_are_only_checked_for_deletion(self):
+        pushed = {'a': None, 'b': None}
+        events = [owned('a', updated='2026-10-16T07:00:00.000Z'), {'id': 'b', 'status': 'cancelled'}]
+        self.assertEqual(stale_ledger_ids(events, pushed, full=False), {'b'})
+
+    def test_full_check_also_finds_missing_events(self):
+        events = [owned('a')]
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=True), {'b', 'c'})
+        self.assertEqual(stale_ledger_ids(events, PUSHED, full=False), set())
+
+class EventRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.record = build_event_record({
+            'date': '2026-10-16', 'time': '8:30am', 'currency': 'USD', 'event': 'Building Permits',
+            'impact': 'High', 'forecast': '1.43M', 'actual': ''
+        })
+
+    def test_body_is_read_only(self):
+        with self.assertRaises(TypeError):
+            self.record.body['summary'] = 'changed'
+        with self.assertRaises(TypeError):
+            self.record.body['start'].update(timeZone='UTC')
+
+    def test_record_is_hashable(self):
+        self.assertEqual(len({self.record, self.record}), 1)
+
+    def test_content_hash_matches_body(self):
+        self.assertEqual(self.record.content_hash, content_hash(dict(self.record.body)))
+
+class FakeResponse(dict):
+    """Stands in for httplib2.Response: a dict of headers with a status."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+class FakeHttpError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.resp = FakeResponse(status, headers)
+
+class FakeRequest:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return self.run()
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batches += 1
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except FakeHttpError as e:
+                self.callback(request_id, None, e)
+
+class FakeCalendar:
+    """An in-memory primary calendar behind the few Calendar calls the worker batches."""
+
+    def __init__(self):
+        self.events_by_id = {}
+        self.batches = 0
+        self.writes = 0
+
+    def events(self):
+        return self
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def _store(self, body):
+        self.writes += 1
+        self.events_by_id[body['id']] = dict(body, updated=f"write-{self.writes}")
+        return self.events_by_id[body['id']]
+
+    def insert(self, calendarId, body):
+        def run():
+            if body['id'] in self.events_by_id:
+                raise FakeHttpError(409)
+            return self._store(body)
+        return FakeRequest(run)
+
+    def update(self, calendarId, eventId, body):
+        def run():
+            if eventId not in self.events_by_id:
+                raise FakeHttpError(404)
+            return self._store(body)
+        return FakeRequest(run)
+
+    def delete(self, calendarId, eventId):
+        return FakeRequest(lambda: self.events_by_id.pop(eventId))
+
+class FlakyRequest(FakeRequest):
+    """Fails with each of `errors` in turn, then succeeds."""
+
+    def __init__(self, *errors):
+        super().__init__(lambda: {'id': 'ok'})
+        self.errors = list(errors)
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().execute()
+
+class ExecuteBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = FakeCalendar()
+        # A private limiter, so the throttles seen here don't slow other tests
+        for patcher in (
+            mock.patch.object(sync_worker, 'LIMITER', RateLimiter()),
+            mock.patch.object(sync_worker.time, 'sleep')
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sleep = sync_worker.time.sleep
+
+    def test_throttled_calls_are_retried(self):
+        flaky = FlakyRequest(FakeHttpError(429, {'retry-after': '7'}))
+        steady = FlakyRequest()
+        responses = {}
+        outcomes = sync_worker._execute_batch(self.service, [('a', flaky), ('b', steady)], 'insert', responses=responses)
+
+        self.assertEqual(outcomes, {'a': None, 'b': None})
+        self.assertEqual(responses, {'a': {'id': 'ok'}, 'b': {'id': 'ok'}})
+        self.assertEqual((flaky.calls, steady.calls, self.service.batches), (2, 1, 2))
+        self.assertGreaterEqual(self.sleep.call_args.args[0], 7)
+
+    def test_other_errors_are_not_retried(self):
+        flaky = FlakyRequest(FakeHttpError(400))
+        outcomes = sync_worker._execute_batch(self.service, [('a', flaky)], 'insert')
+        self.assertEqual(outcomes['a'].resp.status, 400)
+        self.assertEqual(flaky.calls, 1)
+        self.sleep.assert_not_called()
+
+    def test_gives_up_after_max_retries(self):
+        flaky = FlakyRequest(*[FakeHttpError(503) for _ in range(10)])
+        with mock.patch.object(sync_worker, 'CALENDAR_MAX_RETRIES', 2):
+            outcomes = sync_worker._execute_batch(self.service, [('a', flaky)], 'update')
+        self.assertEqual(outcomes['a'].resp.status, 503)
+        self.assertEqual(flaky.calls, 3)
+
+class RunSummaryTest(unittest.TestCase):
+
+    def test_each_worker_writes_its_own_file_and_drops_old_runs(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'sync_summary.json')
+
+        with mock.patch.object(sync_worker, 'WORKER_ID', 'a:1'):
+            sync_worker.write_run_summary([], 1.0, path, run_id='run-1')
+        with mock.patch.object(sync_worker, 'WORKER_ID', 'b:2'):
+            sync_worker.write_run_summary([], 1.0, path, run_id='run-1')
+        self.assertEqual(sorted(os.listdir(tmp.name)), ['sync_summary.a-1.json', 'sync_summary.b-2.json'])
+
+        with mock.patch.object(sync_worker, 'WORKER_ID', 'a:3'):
+            sync_worker.write_run_summary([], 1.0, path, run_id='run-2')
+        self.assertEqual(os.listdir(tmp.name), ['sync_summary.a-3.json'])
+
+class WorkerDbTestCase(TempDbTestCase):
+    """Points the worker at a fresh database file for each test."""
+    db_modules = (sync_worker,)
+
+class RepeatedTitleTest(WorkerDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with open(FIXTURE, encoding='utf-8') as f:
+            self.events = parse_calendar_html(f.read())
+        self.records = build_event_records(self.events)
+        self.speeches = [r for r in self.records if r.body['summary'] == 'EUR - ECB President Lagarde Speaks']
+
+    def test_every_event_gets_its_own_id(self):
+        ids = [record.event_id for record in self.records]
+        self.assertEqual(len(self.speeches), 2)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(re.fullmatch(r'[a-v0-9]{1,100}', event_id) for event_id in ids))
+
+    def test_first_occurrence_keeps_the_plain_id(self):
+        first = next(event for event in self.events if event['event'] == 'ECB President Lagarde Speaks')
+        self.assertEqual(self.speeches[0].event_id, generate_event_id(first))
+        self.assertEqual([r.event_id for r in build_event_records(self.events)], [r.event_id for r in self.records])
+
+    def test_repeat_sync_writes_nothing(self):
+        service = FakeCalendar()
+        user = {'email': 'trader@example.com'}
+        with mock.patch.object(sync_worker, 'connect_calendar', return_value=(mock.Mock(token='t'), service)):
+            first = sync_worker.sync_user(user, self.records)
+            starts = {ev_id: event['start'] for ev_id, event in service.events_by_id.items()}
+            second = sync_worker.sync_user(user, build_event_records(self.events))
+
+        self.assertEqual(first['created'], len(self.records))
+        self.assertEqual((second['status'], second['unchanged'], service.writes), ('skipped', len(self.records), len(self.records)))
+        self.assertEqual({ev_id: event['start'] for ev_id, event in service.events_by_id.items()}, starts)
+        self.assertEqual(len({starts[r.event_id]['dateTime'] for r in self.speeches}), 2)
+
+    def test_archive_keeps_both_and_is_stable(self):
+        sync_worker.archive_events(self.events, seen_at=1000)
+        sync_worker.archive_events(self.events, seen_at=1001)
+
+        conn = database.get_db_connection(self.db_file)
+        rows = conn.execute("SELECT title, time, updated_at FROM events WHERE title = 'ECB President Lagarde Speaks' ORDER BY time").fetchall()
+        count = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        conn.close()
+        self.assertEqual([tuple(row) for row in rows], [
+            ('ECB President Lagarde Speaks', '3:00am', 1000), ('ECB President Lagarde Speaks', '9:00am', 1000)
+        ])
+        self.assertEqual(count, len(self.events))
+
+class WriteEventsTest(WorkerDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with open(FIXTURE, encoding='utf-8') as f:
+            self.events = parse_calendar_html(f.read())
+        self.service = FakeCalendar()
+        self.user = {'email': 'trader@example.com'}
+        self.patch(sync_worker, 'connect_calendar', return_value=(mock.Mock(token='t'), self.service))
+        sync_worker.sync_user(self.user, build_event_records(self.events))
+        self.service.batches = self.service.writes = 0
+
+    def release(self, title, actual):
+        event = next(event for event in self.events if event['event'] == title)
+        event['actual'] = actual
+        return build_event_records(self.events)
+
+    def test_known_event_is_updated_in_one_call(self):
+        result = sync_worker.sync_user(self.user, self.release('Building Permits', '1.45M'))
+        self.assertEqual((result['updated'], result['created']), (1, 0))
+        self.assertEqual((self.service.batches, self.service.writes), (1, 1))
+
+    def test_known_event_deleted_elsewhere_is_inserted_again(self):
+        records = self.release('Building Permits', '1.45M')
+        event_id = next(r.event_id for r in records if r.body['summary'] == 'USD - Building Permits')
+        del self.service.events_by_id[event_id]
+
+        result = sync_worker.sync_user(self.user, records)
+        self.assertEqual((result['updated'], result['created'], result['failed']), (0, 1, 0))
+        self.assertIn(event_id, self.service.events_by_id)
+
+class LeaseTest(WorkerDbTestCase):
+
+    EMAILS = ['a@example.com', 'b@example.com', 'c@example.com', 'd@example.com']
+
+    def setUp(self):
+        super().setUp()
+        conn = database.get_db_connection(self.db_file)
+        conn.executemany("INSERT INTO users (email, refresh_token) VALUES (?, 'token')", [(e,) for e in self.EMAILS])
+        conn.execute("INSERT INTO users (email, refresh_token, delivery) VALUES ('feed@example.com', 'token', 'feed')")
+        conn.commit()
+        conn.close()
+        self.day = datetime.date(2026, 10, 16)
+        self.run_id = sync_worker.start_or_join_run(self.day)
+
+    def as_worker(self, worker_id):
+        return mock.patch.object(sync_worker, 'WORKER_ID', worker_id)
+
+    def claim(self, worker_id, **kwargs):
+        with self.as_worker(worker_id):
+            return [user['email'] for user in sync_worker.claim_users(self.run_id, **kwargs)]
+
+    def user(self, email):
+        conn = database.get_db_connection(self.db_file)
+        row = conn.execute("SELECT claimed_by, claimed_until, last_run_id FROM users WHERE email = ?", (email,)).fetchone()
+        conn.close()
+        return row
+
+    def expire_leases(self):
+        conn = database.get_db_connection(self.db_file)
+        conn.execute("UPDATE users SET claimed_until = ? WHERE claimed_until IS NOT NULL", (time.time() - 1,))
+        conn.commit()
+        conn.close()
+
+    def test_workers_claim_separate_batches(self):
+        first = self.claim('w1', limit=2)
+        second = self.claim('w2', limit=10)
+        self.assertEqual(first, self.EMAILS[:2])
+        self.assertEqual(second, self.EMAILS[2:])
+        self.assertEqual(self.claim('w3'), [])
+        self.assertEqual(self.user('a@example.com')['claimed_by'], 'w1')
+
+    def test_feed_users_are_never_claimed(self):
+        self.assertNotIn('feed@example.com', self.claim('w1'))
+
+    def test_expired_lease_is_reclaimed(self):
+        self.claim('w1')
+        self.expire_leases()
+        self.assertEqual(self.claim('w2'), self.EMAILS)
+        self.assertEqual(self.user('a@example.com')['claimed_by'], 'w2')
+
+    def test_renew_extends_only_own_leases(self):
+        self.claim('w1', limit=2, lease_seconds=60)
+        before = self.user('a@example.com')['claimed_until']
+        with self.as_worker('w1'):
+            self.assertEqual(sync_worker.renew_leases(self.EMAILS[:2], lease_seconds=600), 2)
+        self.assertGreater(self.user('a@example.com')['claimed_until'], before)
+        with self.as_worker('w2'):
+            self.assertEqual(sync_worker.renew_leases(self.EMAILS[:2]), 0)
+
+    def test_checkpoint_releases_the_lease(self):
+        self.claim('w1')
+        with self.as_worker('w1'):
+            sync_worker.checkpoint_user(self.run_id, {'email': 'a@example.com'})
+        self.assertEqual(tuple(self.user('a@example.com')), (None, None, self.run_id))
+        self.assertNotIn('a@example.com', self.claim('w2'))
+
+    def test_checkpoint_after_a_lost_lease_does_nothing(self):
+        self.claim('w1')
+        self.expire_leases()
+        self.claim('w2')
+        with self.as_worker('w1'):
+            sync_worker.checkpoint_user(self.run_id, {'email': 'a@example.com'})
+            self.assertEqual(sync_worker.renew_leases(['a@example.com']), 0)
+        self.assertEqual(self.user('a@example.com')['claimed_by'], 'w2')
+        self.assertIsNone(self.user('a@example.com')['last_run_id'])
+
+    def test_unfinished_run_is_joined(self):
+        self.assertEqual(sync_worker.start_or_join_run(self.day), self.run_id)
+        self.assertNotEqual(sync_worker.start_or_join_run(self.day + datetime.timedelta(days=1)), self.run_id)
+
+    def test_finished_run_starts_a_new_one(self):
+        self.claim('w1')
+        with self.as_worker('w1'):
+            for email in self.EMAILS[:-1]:
+                sync_worker.checkpoint_user(self.run_id, {'email': email})
+            self.assertFalse(sync_worker.finish_run(self.run_id))
+            sync_worker.checkpoint_user(self.run_id, {'email': self.EMAILS[-1]})
+
+        # Nobody called finish_run(): the next start closes the old run itself
+        new_run = sync_worker.start_or_join_run(self.day)
+        self.assertNotEqual(new_run, self.run_id)
+        conn = database.get_db_connection(self.db_file)
+        status = conn.execute("SELECT status FROM sync_runs WHERE run_id = ?", (self.run_id,)).fetchone()[0]
+        conn.close()
+        self.assertEqual(status, 'complete')
+
+if __name__ == '__main__':
+    unittest.main()